@@ -0,0 +1,3 @@
+#benchmarks for bww2abc: a generator of synthetic bww files and timings of
+#each conversion stage, compared against stored baselines.
+#run with: python -m benchmarks --help
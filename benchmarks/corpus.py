@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+#
+#benchmarks.corpus: makes bww files of a chosen size and token mix from the
+#vocabulary of testFile.bww and testFile2.bww, for timing the converter.
+#copyright: 2018
+#GPL v3
+
+import os, random
+
+NOTES = ("LG", "LA", "B", "C", "D", "E", "F", "HG", "HA")
+#the names embellishments and dots use for the same notes
+NOTE_NAMES = ("lg", "la", "b", "c", "d", "e", "f", "hg", "ha")
+DURATIONS = ("4", "8", "8", "16", "16", "16", "32")
+
+#the notes each embellishment style comes on, as in testFile.bww
+LOW_NOTES = ("la", "b", "c", "d", "e", "f")
+STYLES = {
+    "db": NOTE_NAMES,
+    "hdb": ("lg",) + LOW_NOTES,
+    "tdb": ("lg",) + LOW_NOTES,
+    "str": NOTE_NAMES[:8],
+    "gst": LOW_NOTES,
+    "tst": LOW_NOTES + ("hg",),
+    "hst": LOW_NOTES + ("hg",),
+    "st2": LOW_NOTES + ("hg", "ha"),
+    "gst2": LOW_NOTES,
+    "pel": LOW_NOTES,
+    "tpel": LOW_NOTES + ("hg",),
+    "hpel": LOW_NOTES + ("hg",),
+    "grp": ("",),
+    "ggrp": LOW_NOTES,
+    "tgrp": LOW_NOTES + ("hg",),
+    "hgrp": LOW_NOTES + ("hg", "ha"),
+    }
+
+GRACE_NOTES = ("gg", "dg", "eg", "fg", "tg", "ag", "bg", "cg")
+EMBELLISHMENTS = ("thrd", "hthrd", "hvthrd", "gbr", "brl", "tbr", "abr",
+    "tar", "tarb", "htar", "crunl", "crunlb", "bubly", "hbubly", "darodo",
+    "dre", "edre", "gedre", "tdare", "rodin", "din", "embari", "chedari")
+TIME_SIGNATURES = ("2_4", "3_4", "4_4", "6_8", "C", "C_")
+TUNE_TYPES = ("March", "Strathspey", "Reel", "Jig", "Hornpipe", "Slow Air",
+    "Piobaireachd")
+
+#how often each kind of token is picked, relative to the others
+DEFAULT_MIX = {
+    "note": 50,
+    "dot": 5,
+    "grace": 10,
+    "doubling": 8,
+    "strike": 4,
+    "grip": 3,
+    "pele": 2,
+    "embellishment": 6,
+    "slur": 2,
+    "tie": 1,
+    "sub_repeat": 1,
+    "comment": 1,
+    }
+
+HEADER = """Bagpipe Reader:1.0
+
+MIDINoteMappings,(54,56,58,59,61,63,64,66,68,56,58,60,61,63,65,66,68,70,55,57,59,60,62,64,65,67,69)
+
+FrequencyMappings,(370,415,466,494,554,622,659,740,831,415,466,523,554,622,699,740,831,932,392,440,494,523,587,659,699,784,880)
+
+InstrumentMappings,(71,71,45,33,1000,60,70)
+
+GracenoteDurations,(20,40,30,50,100,200,800,1200,250,250,250,500,200)
+
+FontSizes,(90,100,100,80,250)
+
+TuneFormat,(1,0,M,L,500,500,500,500,P,0,0)
+
+TuneTempo,%d
+
+"""
+
+def quote(text, kind, align="L"):
+    return '"%s",(%s,%s,0,0,Times New Roman,16,700,0,0,18,0,0,0)' % (text, kind, align)
+
+class TokenMaker(object):
+    #makes the tokens of one kind at a time, picking kinds by the mix
+    def __init__(self, rng, mix=None):
+            self.rng = rng
+            mix = mix or DEFAULT_MIX
+            self.kinds = [kind for kind in sorted(mix) if mix[kind] > 0]
+            self.weights = [mix[kind] for kind in self.kinds]
+            for kind in self.kinds:
+                if not hasattr(self, "make_" + kind):
+                    raise ValueError("unknown token kind: " + kind)
+            self.comments = 0
+
+    def tokens(self):
+            kind = self.rng.choices(self.kinds, self.weights)[0]
+            return getattr(self, "make_" + kind)()
+
+    def note(self, duration=None, beam=""):
+            return self.rng.choice(NOTES) + beam + "_" + (duration or self.rng.choice(DURATIONS))
+
+    def embellishment(self, styles):
+            style = self.rng.choice(styles)
+            return style + self.rng.choice(STYLES[style])
+
+    def make_note(self):
+            if self.rng.random() < 0.3:
+                #a beamed pair
+                return [self.note("16", "r"), self.note("16", "l")]
+            return [self.note()]
+
+    def make_dot(self):
+            note = self.note("8")
+            dots = "''" if self.rng.random() < 0.1 else "'"
+            return [note, dots + NOTE_NAMES[NOTES.index(note[:-2])]]
+
+    def make_grace(self):
+            return [self.rng.choice(GRACE_NOTES), self.note()]
+
+    def make_doubling(self):
+            return [self.embellishment(("db", "db", "hdb", "tdb")), self.note()]
+
+    def make_strike(self):
+            return [self.embellishment(("str", "gst", "tst", "hst", "st2", "gst2")), self.note()]
+
+    def make_grip(self):
+            return [self.embellishment(("grp", "ggrp", "tgrp", "hgrp")), self.note()]
+
+    def make_pele(self):
+            return [self.embellishment(("pel", "tpel", "hpel")), self.note()]
+
+    def make_embellishment(self):
+            return [self.rng.choice(EMBELLISHMENTS), self.note()]
+
+    def make_slur(self):
+            count = self.rng.choice((2, 3, 3, 3, 43))
+            notes = [self.note("16") for i in range(count if count < 10 else count // 10)]
+            return ["^%ds" % count] + notes + ["^%de" % count]
+
+    def make_tie(self):
+            note = self.note()
+            return ["^ts", note, note, "^te"]
+
+    def make_sub_repeat(self):
+            ending = self.rng.choice(("1", "2", "23"))
+            return ["'" + ending, self.note(), self.note(), "_'"]
+
+    def make_comment(self):
+            self.comments += 1
+            return ["\n" + quote("comment %d" % self.comments, "I") + "\n"]
+
+def generate_tune(rng, maker, size, number):
+    #one tune of about size bytes
+    lines = [quote("Tune %d" % number, "T"),
+        quote(rng.choice(TUNE_TYPES), "Y", "C"),
+        quote("Composer %d" % number, "M", "R"),
+        quote("Footer %d" % number, "F", "R"),
+        ""]
+    length = 0
+    while length < size:
+        part = ["& sharpf sharpc " + rng.choice(TIME_SIGNATURES), "I!''"]
+        for bar in range(8):
+            tokens = []
+            while len(tokens) < 6:
+                tokens.extend(maker.tokens())
+            part.extend(tokens)
+            part.append("!t" if bar % 4 == 3 else "!")
+        part[-1] = "''!I"
+        text = " ".join(part).replace(" !t ", " !t\n").replace("\n ", "\n")
+        lines.append(text)
+        length += len(text)
+    return "\n".join(lines) + "\n\n"
+
+def generate_file(rng, size, mix=None, tunes=1):
+    #the text of a bww file of about size bytes holding tunes tunes
+    maker = TokenMaker(rng, mix)
+    text = [HEADER % rng.randint(60, 100)]
+    for number in range(tunes):
+        text.append(generate_tune(rng, maker, size // tunes, number + 1))
+    return "".join(text)
+
+def write_corpus(directory, files, size, mix=None, tunes=1, seed=0):
+    #write files bww files into directory and return their paths.
+    #the same seed always gives the same corpus
+    rng = random.Random(seed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    paths = []
+    for number in range(files):
+        path = os.path.join(directory, "tune%04d.bww" % number)
+        file_handle = open(path, "w")
+        file_handle.write(generate_file(rng, size, mix, tunes))
+        file_handle.close()
+        paths.append(path)
+    return paths
+
+def parse_mix(text):
+    #"note=50,grip=10" -> a mix, starting from DEFAULT_MIX
+    mix = dict(DEFAULT_MIX)
+    for item in text.split(","):
+        if item.strip():
+            (kind, weight) = item.split("=")
+            mix[kind.strip()] = float(weight)
+    return mix
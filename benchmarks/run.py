@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+#benchmarks.run: times each stage of converting a generated tune, and whole
+#conversions of a generated corpus, and compares them with the baselines.
+#  python -m benchmarks           run and compare with baselines.json
+#  python -m benchmarks --save    run and keep the results as the baselines
+#  python -m benchmarks --startup only time a cold start, see startup.py
+#copyright: 2018
+#GPL v3
+
+import os, io, json, time, shutil, random, tempfile, contextlib
+from optparse import OptionParser
+import bww2abc
+from benchmarks import corpus
+
+STAGES = ("strip", "metadata", "split", "transpose", "abc_text", "write")
+
+baselines_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+#stages faster than this are too noisy to call a regression
+min_compared_time = 0.005
+
+def time_conversion(text, name, output):
+    #convert text a stage at a time with a fresh converter.
+    #returns the seconds each stage took and the number of tokens
+    converter = bww2abc.bwwtoabc()
+    converter.input_file_name = name
+    times = {}
+    clock = time.perf_counter
+    start = clock()
+    def lap(stage):
+        now = clock()
+        times[stage] = now - lap.start
+        lap.start = now
+    lap.start = start
+    text = converter.stripNonPrintableCharacters(text.encode("ascii"))
+    lap("strip")
+    text = converter.get_and_strip_metadata(text)
+    lap("metadata")
+    elements = converter.split_elements(text)
+    lap("split")
+    with bww2abc.paused_gc():
+        for element in elements:
+            converter.transpose(element)
+    converter.finish_tune()
+    lap("transpose")
+    abc = converter.get_abc_text()
+    lap("abc_text")
+    #through an OutputWriter like create_output_file(), a temporary file
+    #that replaces output
+    with bww2abc.OutputWriter(output, converter.only_changed) as writer:
+        writer.write(abc)
+    lap("write")
+    return (times, len(elements))
+
+def time_stages(text, name="bench.bww", repeat=5):
+    #the best time of each stage over repeat conversions of text
+    best = {}
+    (handle, output) = tempfile.mkstemp(suffix=".abc")
+    os.close(handle)
+    try:
+        for run in range(repeat):
+            with contextlib.redirect_stdout(io.StringIO()):
+                (times, tokens) = time_conversion(text, name, output)
+            for stage in STAGES:
+                best[stage] = min(best.get(stage, times[stage]), times[stage])
+    finally:
+        os.remove(output)
+    return (best, tokens)
+
+def time_end_to_end(paths, out_dir, repeat=3):
+    #the best time to convert every file in paths, one process
+    best = None
+    for run in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = bww2abc.convert_files(paths, out_dir, jobs=1)
+        elapsed = time.perf_counter() - start
+        failed = [result for result in results if result[2]]
+        if failed:
+            raise RuntimeError("%s: %s" % (failed[0][0], failed[0][2]))
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run(settings):
+    rng = random.Random(settings["seed"])
+    mix = corpus.parse_mix(settings["mix"])
+    text = corpus.generate_file(rng, settings["size"], mix, settings["tunes"])
+    (stages, tokens) = time_stages(text, repeat=settings["repeat"])
+    work_dir = tempfile.mkdtemp(prefix="bww2abc-bench-")
+    try:
+        paths = corpus.write_corpus(os.path.join(work_dir, "bww"), settings["files"],
+            settings["file_size"], mix, settings["tunes"], settings["seed"])
+        end_to_end = time_end_to_end(paths, os.path.join(work_dir, "abc"), settings["repeat"])
+    finally:
+        shutil.rmtree(work_dir)
+    return {
+        "version": bww2abc.version,
+        "settings": settings,
+        "tokens": tokens,
+        "stages": stages,
+        "transpose_per_token": stages["transpose"] / max(tokens, 1),
+        "end_to_end": end_to_end,
+        }
+
+def compare(results, baselines, threshold):
+    #print results next to baselines. returns the names of the times that
+    #are more than threshold times slower
+    if baselines["settings"] != results["settings"]:
+        bww2abc.do_print("warning: the baselines were made with other settings")
+    rows = [(stage, baselines["stages"].get(stage), results["stages"][stage])
+        for stage in STAGES]
+    rows.append(("end_to_end", baselines.get("end_to_end"), results["end_to_end"]))
+    slower = []
+    bww2abc.do_print("%-12s %12s %12s %8s" % ("stage", "baseline", "now", "ratio"))
+    for (name, baseline, now) in rows:
+        if not baseline:
+            bww2abc.do_print("%-12s %12s %12.6f" % (name, "-", now))
+            continue
+        ratio = now / baseline
+        mark = ""
+        if ratio > threshold and max(now, baseline) >= min_compared_time:
+            slower.append(name)
+            mark = "  SLOWER"
+        bww2abc.do_print("%-12s %12.6f %12.6f %8.2f%s" % (name, baseline, now, ratio, mark))
+    return slower
+
+def report(results):
+    for stage in STAGES:
+        bww2abc.do_print("%-12s %12.6f" % (stage, results["stages"][stage]))
+    bww2abc.do_print("%-12s %12.6f" % ("end_to_end", results["end_to_end"]))
+
+def main(argv=None):
+    parser = OptionParser(usage="python -m benchmarks [options]")
+    parser.add_option("--size", type="int", default=1024 * 1024,
+            help="the size of the tune the stages are timed on (default: 1MB)", metavar="BYTES")
+    parser.add_option("--files", type="int", default=50,
+            help="the number of files converted end to end (default: 50)", metavar="N")
+    parser.add_option("--file-size", dest="file_size", type="int", default=16 * 1024,
+            help="the size of each of those files (default: 16KB)", metavar="BYTES")
+    parser.add_option("--tunes", type="int", default=1,
+            help="tunes in each generated file (default: 1)", metavar="N")
+    parser.add_option("--mix", default="",
+            help="change the token mix, eg note=80,grip=10", metavar="KIND=WEIGHT,...")
+    parser.add_option("--seed", type="int", default=0,
+            help="the seed for the generated files (default: 0)", metavar="N")
+    parser.add_option("--repeat", type="int", default=5,
+            help="runs to take the best time of (default: 5)", metavar="N")
+    parser.add_option("--threshold", type="float", default=1.25,
+            help="fail when a time is this many times its baseline (default: 1.25)", metavar="RATIO")
+    parser.add_option("--baselines", default=baselines_file,
+            help="the baselines file (default: benchmarks/baselines.json)", metavar="FILE")
+    parser.add_option("--save", default=False, action="store_true",
+            help="save the results as the baselines instead of comparing")
+    parser.add_option("--startup", default=False, action="store_true",
+            help="only time starting a process and converting one file")
+    parser.add_option("--startup-file", dest="startup_file", default=None,
+            help="the file --startup converts (default: a generated --file-size file)", metavar="FILE")
+    parser.add_option("--generate", default=None,
+            help="only write a corpus of --files files into DIR", metavar="DIR")
+    (options, args) = parser.parse_args(argv)
+
+    if options.generate:
+        corpus.write_corpus(options.generate, options.files, options.file_size,
+            corpus.parse_mix(options.mix), options.tunes, options.seed)
+        return 0
+
+    settings = {
+        "size": options.size,
+        "files": options.files,
+        "file_size": options.file_size,
+        "tunes": options.tunes,
+        "mix": options.mix,
+        "seed": options.seed,
+        "repeat": options.repeat,
+        }
+    if options.startup:
+        from benchmarks import startup
+        startup.report(startup.run(settings, options.startup_file))
+        return 0
+    results = run(settings)
+    if options.save:
+        file_handle = open(options.baselines, "w")
+        json.dump(results, file_handle, indent=1, sort_keys=True)
+        file_handle.write("\n")
+        file_handle.close()
+        report(results)
+        return 0
+    if not os.path.exists(options.baselines):
+        report(results)
+        bww2abc.do_print("no baselines to compare with, use --save to make them")
+        return 0
+    file_handle = open(options.baselines)
+    baselines = json.load(file_handle)
+    file_handle.close()
+    slower = compare(results, baselines, options.threshold)
+    if slower:
+        bww2abc.do_print("slower than the baselines: " + ", ".join(slower))
+        return 1
+    return 0
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+#benchmarks.startup: times a cold start, a new python process converting
+#one file, split into the interpreter, importing bww2abc and the rest.
+#  python -m benchmarks --startup [--startup-file FILE]
+#copyright: 2018
+#GPL v3
+
+import os, sys, re, time, random, shutil, tempfile, subprocess
+import bww2abc
+from benchmarks import corpus
+
+script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bww2abc.py")
+
+def time_command(command, repeat, env=None):
+    #the best wall time of running command, in seconds
+    best = None
+    for run in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def import_time(repeat, env=None):
+    #the best time python -X importtime gives for import bww2abc, in
+    #seconds, counting the modules it imports
+    best = None
+    for run in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import bww2abc"],
+            env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        for line in result.stderr.splitlines():
+            match = re.match(r"import time:\s*\d+ \|\s*(\d+) \| bww2abc$", line)
+            if match:
+                elapsed = int(match.group(1)) / 1000000.0
+                best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run(settings, input_file=None):
+    #time the startup of converting input_file, or a generated file of
+    #settings["file_size"] bytes
+    work_dir = tempfile.mkdtemp(prefix="bww2abc-startup-")
+    try:
+        if input_file is None:
+            input_file = os.path.join(work_dir, "startup.bww")
+            rng = random.Random(settings["seed"])
+            file_handle = open(input_file, "w")
+            file_handle.write(corpus.generate_file(rng, settings["file_size"],
+                corpus.parse_mix(settings["mix"]), settings["tunes"]))
+            file_handle.close()
+        output = os.path.join(work_dir, "startup.abc")
+        #run from the checkout, whatever the current directory
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [os.path.dirname(script)] + [path for path in [env.get("PYTHONPATH")] if path])
+        repeat = settings["repeat"]
+        #a first run to warm the file and bytecode caches
+        time_command([sys.executable, script, "-i", input_file, "-o", output, "--no-server"], 1, env)
+        interpreter = time_command([sys.executable, "-c", "pass"], repeat, env)
+        import_wall = time_command([sys.executable, "-c", "import bww2abc"], repeat, env)
+        cli = time_command([sys.executable, script, "-i", input_file, "-o", output, "--no-server"],
+            repeat, env)
+        imports = import_time(repeat, env)
+    finally:
+        shutil.rmtree(work_dir)
+    return {
+        "interpreter": interpreter,
+        "import": imports,
+        "import_wall": import_wall,
+        "cli": cli,
+        "convert": cli - import_wall,
+        }
+
+def report(results):
+    bww2abc.do_print("%-12s %12.6f  python -c pass" % ("interpreter", results["interpreter"]))
+    bww2abc.do_print("%-12s %12.6f  -X importtime, bww2abc and its imports" % ("import", results["import"]))
+    bww2abc.do_print("%-12s %12.6f  python -c 'import bww2abc'" % ("import_wall", results["import_wall"]))
+    bww2abc.do_print("%-12s %12.6f  python bww2abc.py -i FILE" % ("cli", results["cli"]))
+    bww2abc.do_print("%-12s %12.6f  cli - import_wall" % ("convert", results["convert"]))
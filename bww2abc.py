@@ -5,64 +5,518 @@
 #copyright: 2018
 #GPL v3
 
-from optparse import OptionParser
-import sys,os,re,subprocess
-import string;
+import sys,os,re
+#re imports functools and collections already, and python itself io and
+#time, so they cost nothing. the rest are imported where they are used
+import functools, collections, time, io
 
 version = "0.9.0"
 
-#make a print function to handle various version of python
+#print a message for the user
 def do_print(string):
+    print(string)
+
+#raised when a file can't be converted
+class ConversionError(Exception):
+    pass
+
+#a note in the tune. it stays an object until the tune is written out so
+#dots can change its length without parsing the text again
+class Note(object):
+    __slots__ = ("prefix", "pitch", "duration", "length", "suffix")
+
+    def __init__(self, pitch, duration, length, prefix=""):
+            self.prefix = prefix
+            self.pitch = pitch
+            #a Fraction, or None when the note has no length
+            self.duration = duration
+            #the duration as abc text
+            self.length = length
+            self.suffix = ""
+
+    def set_duration(self, duration):
+            self.duration = duration
+            self.length = format_length(duration)
+
+    def __str__(self):
+            return self.prefix + self.pitch + self.length + self.suffix
+
+#write a note duration the way abc does, eg 3/2
+def format_length(duration):
+    if duration is None:
+        return ""
+    if duration.denominator == 1:
+        return str(duration.numerator)
+    return "%d/%d" % (duration.numerator, duration.denominator)
+
+#the notes don't make reference cycles, so while a tune grows there is
+#nothing for the garbage collector to find by walking them
+class paused_gc(object):
+    def __enter__(self):
+            import gc
+            self.collecting = gc.isenabled()
+            gc.disable()
+
+    def __exit__(self, *exc_info):
+            import gc
+            if self.collecting:
+                gc.enable()
+
+#turn tune elements into abc text
+def render_elements(elements):
+    return "".join([str(element) for element in elements])
+
+def render_chunks(elements, size=4096):
+    #the abc text of tune elements a piece at a time
+    for start in range(0, len(elements), size):
+        yield render_elements(elements[start:start + size])
+
+#Reading bww files: they are read as bytes and everything that isn't
+#printable ascii is dropped, whatever the encoding, so latin-1, cp1252 and
+#utf-8 files read the same and a stray byte can't stop a conversion. Only
+#utf-16, found by its byte order mark, is decoded first. Newlines become
+#\n as text mode reading made them.
+#everything but tab, the newlines and the characters of string.printable
+NON_PRINTABLE_BYTES = bytes(range(0, 9)) + bytes(range(14, 32)) + bytes(range(127, 256))
+UTF16_BOMS = (b"\xff\xfe", b"\xfe\xff")
+
+def read_bww(path):
+    #the bytes of a bww file, ready for clean_bytes()
+    import mmap
+    file_handle = open(path, "rb")
     try:
-        eval("print "+string)
-    except:
-        print(string)
+        try:
+            mapping = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            #empty files and pipes can't be mapped
+            data = file_handle.read()
+        else:
+            with mapping:
+                data = mapping[:]
+    finally:
+        file_handle.close()
+    return normalize_newlines(decode_bom(data))
+
+def read_bww_chunks(path, chunk_size):
+    #yield the bytes of a bww file a chunk at a time, like read_bww()
+    with open(path, "rb") as file_handle:
+        if file_handle.read(2) in UTF16_BOMS:
+            file_handle.seek(0)
+            reader = io.TextIOWrapper(file_handle, encoding="utf-16",
+                errors="replace", newline="")
+            read = lambda: reader.read(chunk_size).encode("utf-8", "surrogatepass")
+        else:
+            file_handle.seek(0)
+            read = lambda: file_handle.read(chunk_size)
+        #a \r at the end of a chunk may be half of a \r\n
+        pending = b""
+        while True:
+            chunk = read()
+            if not chunk:
+                break
+            chunk = pending + chunk
+            pending = b""
+            if chunk.endswith(b"\r"):
+                (chunk, pending) = (chunk[:-1], b"\r")
+            yield normalize_newlines(chunk)
+        if pending:
+            yield b"\n"
+
+#the longest quote the streaming conversion waits for the end of. quotes
+#are titles and comments, so a quote mark without another one this far
+#after it is a stray one and stays in the text
+MAX_QUOTE_LENGTH = 4096
+
+def decode_bom(data):
+    if data[:2] in UTF16_BOMS:
+        return data.decode("utf-16", "replace").encode("utf-8", "surrogatepass")
+    return data
+
+def normalize_newlines(data):
+    if b"\r" not in data:
+        return data
+    return data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+def clean_bytes(data):
+    #returns the printable ascii text of data and whether anything was
+    #dropped. text is cleaned the same way, a character at a time.
+    if isinstance(data, str):
+        data = data.encode("utf-8", "surrogatepass")
+    cleaned = data.translate(None, NON_PRINTABLE_BYTES)
+    return (cleaned.decode("ascii"), len(cleaned) != len(data))
+
+#Writing outputs: the text goes into a temporary file next to the output,
+#through a buffer, and the temporary file is renamed over the output when
+#it is complete. Anything reading the output meanwhile, like a web server,
+#sees the old file or the new one and never half of one.
+class OutputWriter(object):
+    #with only_changed an output that already has the same text is left
+    #alone, so its mtime doesn't change and make-style tools don't rebuild
+    #from it. newline is like open()'s: None writes \n as os.linesep
+    def __init__(self, path, only_changed=False, newline=None, buffer_size=65536):
+            self.path = path
+            self.only_changed = only_changed
+            self.linesep = os.linesep if newline is None else (newline or "\n")
+            (directory, name) = os.path.split(path)
+            self.temp_path = os.path.join(directory,
+                ".%s.%s.tmp" % (name, os.urandom(4).hex()))
+            #made like open() makes a file, so the umask applies
+            handle = os.open(self.temp_path,
+                os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+            self.file_handle = os.fdopen(handle, "wb", buffer_size)
+            #the old output, while everything written so far matches it
+            self.old = None
+            if only_changed:
+                try:
+                    self.old = open(path, "rb")
+                except OSError:
+                    pass
+            self.changed = self.old is None
+
+    def write(self, text):
+            if self.linesep != "\n":
+                text = text.replace("\n", self.linesep)
+            self.write_bytes(text.encode("utf-8"))
+
+    def write_bytes(self, data):
+            #bytes are written as they are, without newline translation
+            self.file_handle.write(data)
+            if not self.changed and self.old.read(len(data)) != data:
+                self.changed = True
+
+    def flush(self):
+            self.file_handle.flush()
+
+    def commit(self):
+            #put the output in place. returns whether it was written
+            self.file_handle.close()
+            if self.old is not None:
+                if not self.changed and self.old.read(1):
+                    self.changed = True
+                self.old.close()
+            if not self.changed:
+                os.remove(self.temp_path)
+                return False
+            try:
+                #an output being replaced keeps its permissions, as open() would
+                os.chmod(self.temp_path, os.stat(self.path).st_mode & 0o7777)
+            except OSError:
+                pass
+            os.replace(self.temp_path, self.path)
+            return True
+
+    def abort(self):
+            #leave the old output as it was
+            self.file_handle.close()
+            if self.old is not None:
+                self.old.close()
+            try:
+                os.remove(self.temp_path)
+            except OSError:
+                pass
 
-#define the class that will convert a bww file to a abc file
-class bwwtoabc :
+    def __enter__(self):
+            return self
+
+    def __exit__(self, kind, value, traceback):
+            if kind is None:
+                self.commit()
+            else:
+                self.abort()
+
+#where conversions spent their time and which elements they met. a
+#converter records into one after enable_stats(); batch runs merge them.
+class ConversionStats(object):
     def __init__(self):
-            self.tune_elements = []
-            self.comments_list = [];
-            self.most_recent_note = 0
-            self.in_note_group = False
-            self.slur_ties_pending = 0;
-            self.slur_tie_back = False
-            self.unparsed_time_sig = [];
+            self.files = 0
+            self.elements = 0
+            #the files whose abc came from a bww2abc_cache
+            self.cache_hits = 0
+            #the whole batch, when there was one
+            self.wall_time = 0.0
+            #stage -> seconds
+            self.times = {}
+            #element category -> count
+            self.categories = {}
+
+    def add_time(self, stage, seconds):
+            self.times[stage] = self.times.get(stage, 0.0) + seconds
+
+    def count(self, category, number=1):
+            self.categories[category] = self.categories.get(category, 0) + number
+
+    def merge(self, other):
+            self.files += other.files
+            self.elements += other.elements
+            self.cache_hits += other.cache_hits
+            for (stage, seconds) in other.times.items():
+                self.add_time(stage, seconds)
+            for (category, number) in other.categories.items():
+                self.count(category, number)
+
+    def as_dict(self):
+            return {
+                "files": self.files,
+                "elements": self.elements,
+                "cache_hits": self.cache_hits,
+                "wall_time": self.wall_time,
+                "times": dict(self.times),
+                "categories": dict(self.categories),
+                }
+
+    def format_text(self):
+            lines = ["files: %d" % self.files, "elements: %d" % self.elements]
+            if self.cache_hits:
+                lines.append("cache hits: %d" % self.cache_hits)
+            if self.wall_time:
+                lines.append("wall time: %.3fs" % self.wall_time)
+            lines.append("times:")
+            for (stage, seconds) in sorted(self.times.items(), key=lambda item: -item[1]):
+                lines.append("  %-12s %9.3fs" % (stage, seconds))
+            lines.append("categories:")
+            for (category, number) in sorted(self.categories.items(), key=lambda item: -item[1]):
+                lines.append("  %-20s %9d" % (category, number))
+            return "\n".join(lines)
+
+#the converter's warnings, by code. the arguments are only formatted in
+#when a warning is shown
+WARNINGS = {
+    "multiple_tunes": "File contains multiple tunes and should be examined closely.",
+    "non_printable": "This file contains non-printable characters which will be ignored.",
+    "bad_bang": "Replacing \"%s\" with \"%s\" before parse",
+    "unmatched_tie": "Unmatched tie start found.",
+    "dot_at_start": "This tune starts with a dot which will not be parsed.",
+    "doubledot_at_start": "This tune starts with a double dot which will not be parsed.",
+    "no_note_value": "cant get value of %s Using 1",
+    "missing_type": "This file has more tune titles than tune types",
+    "missing_composer": "This file has more tune titles than tune composers",
+    "missing_footer": "This file has more tune titles than tune footers",
+    "zero_value": "Cannot parse the note with _0. Just using a value of 1.",
+    "slur_too_long": "Cannot find the start of a slur over %d notes. Ignoring it.",
+    "unparsed": "unparsed: %s",
+    }
+
+def format_warning(code, args):
+    return WARNINGS[code] % args if args else WARNINGS[code]
+
+#collects the warnings of a conversion as (code, arguments, position)
+#events, the position being the index of the bww element or None. modes:
+#  each     print each warning as it happens, as bww2abc always has
+#  summary  print each distinct warning once, with a count, at the end
+#  json     print a json line per warning at the end
+#  quiet    only count them
+#  collect  keep them for the caller to replay() elsewhere
+#max_warnings limits how many are printed. with show_names, for runs of
+#many files, each printed warning starts with the name of its file.
+class Diagnostics(object):
+    MODES = ("each", "summary", "json", "quiet", "collect")
+
+    def __init__(self, mode="each", max_warnings=None, keep=False, show_names=False):
+            if mode not in self.MODES:
+                raise ValueError("unknown warnings mode: " + mode)
+            self.mode = mode
+            self.max_warnings = max_warnings
+            #keep the events even when they aren't needed for the report
+            self.keep = keep or mode in ("summary", "json", "collect")
+            self.echo = mode == "each"
+            self.show_names = show_names
+            self.clear()
+
+    def clear(self):
+            self.count = 0
+            self.events = []
+
+    def copy(self):
+            #a new collector with the same settings
+            return Diagnostics(self.mode, self.max_warnings, self.keep, self.show_names)
+
+    def settings(self):
+            #"" for the default settings, which print what bww2abc always did
+            if self.mode == "each" and self.max_warnings is None and not self.show_names:
+                return ""
+            settings = "%s:%s" % (self.mode, self.max_warnings)
+            if self.show_names:
+                settings += ":names"
+            return settings
+
+    def prefix(self, name):
+            #what a printed warning about the file name starts with
+            if self.show_names and name:
+                return name + ": "
+            return ""
+
+    def warn(self, code, args=(), position=None, name=""):
+            self.count += 1
+            if self.keep:
+                self.events.append((code, args, position))
+            if self.echo and (self.max_warnings is None or self.count <= self.max_warnings):
+                print(self.prefix(name) + format_warning(code, args))
+
+    def replay(self, events, position_offset=0, name=""):
+            #warn about events collected elsewhere, eg in another process
+            for (code, args, position) in events:
+                if position is not None:
+                    position += position_offset
+                self.warn(code, args, position, name)
+
+    def summary(self):
+            #[(code, arguments, count)] in the order they first appeared
+            counts = collections.OrderedDict()
+            for (code, args, position) in self.events:
+                key = (code, args)
+                counts[key] = counts.get(key, 0) + 1
+            return [(code, args, number) for ((code, args), number) in counts.items()]
+
+    def finish(self, name=""):
+            #print the report for the conversion of name, and start again
+            if self.mode == "collect":
+                return
+            limit = self.max_warnings
+            if self.mode == "summary":
+                lines = []
+                for (code, args, number) in self.summary():
+                    line = format_warning(code, args)
+                    if number > 1:
+                        line += " (x%d)" % number
+                    lines.append(line)
+                if limit is not None and len(lines) > limit:
+                    lines[limit:] = ["%d more kinds of warning not shown" % (len(lines) - limit)]
+                for line in lines:
+                    print(self.prefix(name) + line)
+            elif self.mode == "json":
+                import json
+                for (code, args, position) in self.events[:limit]:
+                    print(json.dumps({"file": name, "code": code,
+                        "message": format_warning(code, args), "position": position},
+                        sort_keys=True))
+            elif self.echo and limit is not None and self.count > limit:
+                print(self.prefix(name) + "%d more warnings not shown" % (self.count - limit))
+            self.clear()
 
+#define the class that will convert a bww file to a abc file
+class bwwtoabc :
+    tables_built = False
+    #the most notes back a slur with a count of up to two digits starts,
+    #see parse_slur()
+    max_slur_notes = 10
+
+    def __init__(self, cache_size=4096):
+            if not bwwtoabc.tables_built:
+                bwwtoabc.build_tables()
+            self.reset()
+            self.input_file_name = ""
+            #a ConversionStats when recording, see enable_stats()
+            self.stats = None
+            self.lap_start = 0.0
+            #where the warnings go
+            self.diagnostics = Diagnostics()
+            #leave outputs that already have the right abc alone
+            self.only_changed = False
+
+            #map every category to the method that resolves it to an action,
+            #and every action to the method that applies it to the tune
+            self.element_resolvers = dict(
+                (category, getattr(self, "resolve_" + category)) for category in self.categories)
+            actions = ("append", "note", "dot", "doubledot", "slur", "tie", "comment",
+                "header", "tempo", "ignore", "time_sig", "fermat", "mark_previous", "unparsed")
+            self.action_handlers = dict(
+                (action, getattr(self, "apply_" + action)) for action in actions)
+
+            #bww tunes use a small vocabulary, so remember the action each
+            #element resolved to. only the apply_ part runs on a hit.
+            self.resolve_cached = functools.lru_cache(maxsize=cache_size)(self.resolve)
+
+    @classmethod
+    def build_tables(cls):
+            #the patterns and tables every converter shares. they are made
+            #when the first converter is, so importing bww2abc stays cheap
             # compile a few regex queries
             #make a regex to determine if something is a abc note
-            self.regex_abcnote= re.compile("^[abcdefgAGB][0-9]*(/[0-9]*)?")
+            cls.regex_abcnote= re.compile("^[abcdefgAGB][0-9]*(/[0-9]*)?")
             #try to determine the time signature
-            self.sig_regex = re.compile("([0-9])_([0-9])")
-            #a regex to find notes
-            self.regex_note_info = re.compile("(?P<note>[A-Z]+)(?P<dir>[l|r]*)_(?P<time>[0-9]{1,2})")
-            #a regex to find grace notes
-            self.regex_grace_note = re.compile("^([h|l]*[abcdefgt])g$")
-            self.regex_doublegracenote = re.compile("^([d|e|f|g|t])([h|l]*[a-g])$")
-            #a regex to parse doublings
-            self.regex_doubling = re.compile("^db([h|l]*[a-g])")
-            #a regex to parse half_doublings
-            self.regex_half_doubling = re.compile("^hdb([h|l]*[a-g])")
-            #a regex to parse thumb_doublings
-            self.regex_thumb_doubling = re.compile("^tdb([h|l]*[a-g])")
-            #a regex for finding single strikes
-            self.regex_single_strike = re.compile("^str([h|l]*[a-g])")
-            #a regex for finding G Grace not, themb and half strikes
-            self.regex_strike = re.compile("^([l]?)(g|t|h)*st(2|3)*([h|l]*[a-g])");
-            #a regex for finding grips
-            self.regex_grip = re.compile("^(grp|ggrp|tgrp|hgrp)((?:ha|hg|la|lg|[b-f])?)")
-            self.regex_pele = re.compile("^(l)*([t|h]?)pel([h|l]*[a-g]){0,1}")
-            #a regex to find dots
-            self.regex_dot = re.compile("^'[h|l]*[a-g]$")
-            self.regex_doubledot = re.compile("^''[h|l]*[a-g]")
-            #a regex to find sub repeats
-            self.regex_sub_repeat = re.compile("^'([0-9]+)")
-            #a regex to find note slurs, not slur embellishments
-            self.regex_slur = re.compile("\^(?P<note_count>[0-9]+)(?P<end_note>[h|l]*[a-g]*)(?P<start_stop>[s|e]*)")
+            cls.sig_regex = re.compile("([0-9])_([0-9])")
+            #get the title,type,author of the file, these are in quotes
+            cls.regex_quote = re.compile("\"(?P<content>.*?)\"(,\((?P<type>[A-Z]).*?\))?", flags=re.S|re.M)
+            #bagpipe player settings that are not part of the tune
+            cls.regex_junk_keyword = re.compile("MIDINoteMappings|FrequencyMappings|InstrumentMappings|GracenoteDurations|FontSizes|TuneFormat")
+            #the "Other junk": the Bagpipe line and the player settings up to a close parens
+            cls.regex_bagpipe = re.compile(r'Bagpipe.*')
+            cls.regex_junk = re.compile(r'^(' + cls.regex_junk_keyword.pattern + r')(,.*?\))?', flags=re.S|re.M)
+            #greedy, multiline, from first ampersand to the end
+            cls.regex_notes = re.compile("&.*", re.S)
+            #imported here rather than with bww2abc, for a quick start
+            import fractions
+            #the abc of every embellishment, made from the rules in bwwtoabc.
+            #without it the rules work each one out
+            try:
+                from bww2abc_embellishments import EMBELLISHMENTS
+            except ImportError:
+                EMBELLISHMENTS = {}
+            cls.embellishments = EMBELLISHMENTS
+            #the length of each bww note value, in eighth notes
+            cls.note_values = {
+            "64":fractions.Fraction(1, 8),
+            "32":fractions.Fraction(1, 4),
+            "16":fractions.Fraction(1, 2),
+            "8" :fractions.Fraction(1),
+            "4" :fractions.Fraction(2),
+            "2" :fractions.Fraction(4),
+            "1" :fractions.Fraction(8),
+            "0" :None
+            }
+            #what a dot and two dots make the length of a note
+            cls.dot_length = fractions.Fraction(3, 2)
+            cls.doubledot_length = fractions.Fraction(7, 4)
+
+            #one anchored pattern for every parameterized bww element.
+            #each family is a named group and the families are listed in the
+            #order they must be tried, so the first family that matches wins.
+            element_families = (
+                #notes can appear anywhere in the element
+                ("note", ".*?(?P<note_name>[A-Z]+)(?P<note_dir>[l|r]*)_(?P<note_time>[0-9]{1,2})"),
+                #grace notes
+                ("grace", "(?P<grace_note>[h|l]*[abcdefgt])g$"),
+                ("doublegrace", "(?P<doublegrace_first>[d|e|f|g|t])(?P<doublegrace_second>[h|l]*[a-g])$"),
+                #doublings, half doublings and thumb doublings
+                ("doubling", "db(?P<doubling_note>[h|l]*[a-g])"),
+                ("half_doubling", "hdb(?P<half_doubling_note>[h|l]*[a-g])"),
+                ("thumb_doubling", "tdb(?P<thumb_doubling_note>[h|l]*[a-g])"),
+                #single strikes
+                ("single_strike", "str(?P<single_strike_note>[h|l]*[a-g])"),
+                #G Grace note, thumb and half strikes
+                ("strike", "(?P<strike_light>[l]?)(?P<strike_type>g|t|h)*st(?P<strike_count>2|3)*(?P<strike_note>[h|l]*[a-g])"),
+                #grips
+                ("grip", "(?P<grip_style>grp|ggrp|tgrp|hgrp)(?P<grip_note>(?:ha|hg|la|lg|[b-f])?)"),
+                ("pele", "(?P<pele_light>l)*(?P<pele_style>[t|h]?)pel(?P<pele_note>[h|l]*[a-g]){0,1}"),
+                #dots
+                ("dot", "'[h|l]*[a-g]$"),
+                ("doubledot", "''[h|l]*[a-g]"),
+                #note slurs, not slur embellishments
+                ("slur", ".*?\\^(?P<slur_count>[0-9]+)(?P<slur_end_note>[h|l]*[a-g]*)(?P<slur_start_stop>[s|e]*)"),
+                #bww tie slurs
+                ("tie", "\\^t"),
+                #comment and header placeholders
+                ("comment", "comment"),
+                ("header", "header"),
+                ("tempo", "TuneTempo,[^0-9]*(?P<tempo_value>[0-9]+)"),
+                #the start of a sub_repeat
+                ("sub_repeat", "'(?P<sub_repeat_num>[0-9]+)"),
+                #time signatures
+                ("time_sig", ".*?(?P<sig>(?P<sig_num>[0-9])_(?P<sig_den>[0-9]))"),
+                ("fermat", "fermat"),
+                ("sharp", "sharp"),
+                ("natural", "natural"),
+                ("flat", "flat"),
+                ("echo", "echo"),
+                )
+            cls.regex_element = re.compile(
+                "|".join("(?P<%s>%s)" % family for family in element_families),
+                flags=re.S)
+
             #we need a list to ignore
-            self.ignore_elements = ("sharpf","sharpc","space","&")
+            cls.ignore_elements = ("sharpf","sharpc","space","&")
             #create a dictionary of common bww elements and their abc counterparts
-            self.transpose_dict = {
+            cls.transpose_dict = {
                 "!"             :" | ",        # Bar sign
                 "''!I"          :" :|!\n",     # End part w/Repeat
                 "''!It"         :" :|!\n",     # This exists for some reason?
@@ -157,6 +611,107 @@ class bwwtoabc :
                 "segno"         :"!segno!",
                 "dalsegno"      :"!D.S.!",
                 }
+            #piobaireachd markings that decorate the most recent note
+            cls.previous_note_marks = {
+                "pc"            :"\"_C\"",      # Crunluath
+                "pcb"           :"\"_C\"",
+                "phcla"         :"\"_C\"",
+                "pt"            :"\"_T\"",      # Toarluath
+                "ptb"           :"\"_T\"",
+                "phtla"         :"\"_T\"",
+                "ptbrea"        :"\"_T\"",
+                "pl"            :"\"_L\"",      # Lemluath
+                "plb"           :"\"_L\"",
+                "phlla"         :"\"_L\"",
+                "pclg"          :"\"_\\u1D12\"", # Want a sideways C... this is the closest I found
+                "ptlg"          :"\"_\\u22A2\"", # right tack - i dont know what this is
+                "padeda"        :"P",          # add a mordent (squiggle) on PREVIOUS note
+                }
+            #piobaireachd markings that are placed before the next note
+            cls.next_note_marks = {
+                "pcmb"          :"\"_\\u0186\"", # Crunluath a mach insert reversed c U+0186
+                "pcmd"          :"\"_\\u0186\"",
+                "pcmc"          :"\"_\\u0186\"",
+                "ptmb"          :"\"_\\u22A5\"", # Taorluath a machs Insert an up tack U+22A5
+                "ptmc"          :"\"_\\u22A5\"",
+                "ptmd"          :"\"_\\u22A5\"",
+                "ptriplg"       :"\"_\\u2261\"", # G gracenote triplings Insert a triple bar
+                "ptripla"       :"\"_\\u2261\"",
+                "ptripb"        :"\"_\\u2261\"",
+                "ptripc"        :"\"_\\u2261\"",
+                "pembari"       :"P",          # add a mordent (squiggle) on NEXT note
+                "pendari"       :"P",
+                "phiharin"      :"P",
+                "pdare"         :"P",
+                "penbain"       :"P",
+                "potro"         :"P",
+                "podro"         :"P",
+                "pedre"         :"P",
+                "pdili"         :"!trill!",    # add a trill (tr)
+                "ptra"          :"!trill!",
+                "phtra"         :"!trill!",
+                "ptra8"         :"!trill!",
+                "pgrp"          :"!trill!",
+                "pchedari"      :"!turn!",
+                "phedari"       :"!turn!",
+                "pdarodo"       :"!turn!",     # add a turn??? modifies NEXT note
+                "pdarodo16"     :"!turn!",
+                "phdarodo"      :"!turn!",
+                }
+
+            #build an exact match table for the fixed bww elements.
+            #each group of fixed elements is tried right after the named
+            #parameterized family, so an element that an earlier family
+            #would claim keeps that family's category.
+            family_order = [name for (name, pattern) in element_families]
+            fixed_families = (
+                ("ignore", "sub_repeat", cls.ignore_elements),
+                ("common_time", "time_sig", ("C", "c")),
+                ("cut_time", "time_sig", ("C_", "c_")),
+                ("previous_note_mark", "echo", cls.previous_note_marks),
+                ("next_note_mark", "echo", cls.next_note_marks),
+                ("dict_embellishment", "echo", cls.transpose_dict),
+                )
+            cls.fixed_elements = {}
+            for (category, follows, elements) in fixed_families:
+                for element in elements:
+                    if element in cls.fixed_elements:
+                        continue
+                    match = cls.regex_element.match(element)
+                    if match and family_order.index(match.lastgroup) <= family_order.index(follows):
+                        cls.fixed_elements[element] = (match.lastgroup, match)
+                    else:
+                        cls.fixed_elements[element] = (category, None)
+
+            #the elements starting with a bang that split_elements() leaves
+            #alone. a lone bang is a bar line.
+            cls.bang_elements = frozenset(["!"] +
+                [element for element in cls.transpose_dict if element.startswith("!")])
+
+            #every category an element can be sorted into
+            cls.categories = family_order + [family[0] for family in fixed_families] + ["unparsed"]
+            cls.tables_built = True
+
+    def reset(self):
+            #forget the tune being converted, keeping the tables and the
+            #action cache so the converter can be reused
+            self.tune_elements = []
+            #the index of the element being converted, for warnings
+            self.position = None
+            #indices into tune_elements of the notes a slur can start on
+            self.note_positions = []
+            self.comments_list = [];
+            self.most_recent_note = 0
+            self.in_note_group = False
+            self.slur_ties_pending = 0;
+            self.slur_tie_back = False
+            self.unparsed_time_sig = [];
+            self.tune_title = []
+            self.tune_type = []
+            self.tune_author = []
+            self.tune_footer = []
+            #the tunes before this one when converting part of a file
+            self.tune_number_offset = 0
 
     def parse_quote(self, comment_element):
 
@@ -169,7 +724,7 @@ class bwwtoabc :
             # Saving in tune header info.
             if commentType == "T":
                 if self.tune_title:
-                    do_print("File contains multiple tunes and should be examined closely.");
+                    self.warn("multiple_tunes")
                 self.tune_title.append(commentText);
             elif commentType == "Y":
                 self.tune_type.append(commentText);
@@ -193,13 +748,14 @@ class bwwtoabc :
             return replacementText;
 
     def stripNonPrintableCharacters(self, file_text):
-            filtered_string = ''.join(filter(lambda x:x in string.printable, file_text));
-            if filtered_string != file_text:
-                do_print("This file contains non-printable characters which will be ignored.")
+            #file_text is text, or bytes from read_bww()
+            (filtered_string, dropped) = clean_bytes(file_text)
+            if dropped:
+                self.warn("non_printable")
             return filtered_string;
     def get_and_strip_metadata(self, file_text):
             #get the title,type,author of the file, these are in quotes
-            quote_regex = re.compile("\"(?P<content>.*?)\"(,\((?P<type>[A-Z]).*?\))?", flags=re.S|re.M)
+            quote_regex = self.regex_quote
             # tune_info = quote_regex.findall(file_text)
 
             self.tune_title = []
@@ -223,60 +779,402 @@ class bwwtoabc :
                 self.tune_time_sig = "C"
 
             # Strip the "Other junk" up to a close parens.
-            sub_rule = r'Bagpipe.*';
-            file_text_out = re.sub(sub_rule, "", file_text_out);
-            sub_rule = r'^(MIDINoteMappings|FrequencyMappings|InstrumentMappings|GracenoteDurations|FontSizes|TuneFormat)(,.*?\))?';
+            file_text_out = self.regex_bagpipe.sub("", file_text_out);
             # TODO TuneTempo
-            file_text_out = re.sub(sub_rule, "", file_text_out, flags=re.S|re.M);
+            file_text_out = self.regex_junk.sub("", file_text_out);
             
             return file_text_out;
-    def replaceBadBang(self, matchObj):
-            # if this isn't in the dict, try to throw in a space first.
-            if matchObj.group(0) not in self.transpose_dict.keys():
-                replacement = matchObj.group("bang") + " " + matchObj.group("nextpart");
-                do_print("Replacing \"" + matchObj.group(0) + "\" with \"" + replacement + "\" before parse");
-            else:
-               replacement = matchObj.group(0);
-            return replacement;
     def parse(self):
             # create a string that represents the converted contents of the file
-            #open the file read only
-            file_handle = open(self.original_file,"r")
-            #read the contents of the file
-            file_text = file_handle.read()
-
+            self.start_laps()
+            file_data = read_bww(self.original_file)
+            self.lap("read")
+            self.parse_text(file_data)
+
+    # Statistics: with enable_stats() the converter times each stage and
+    # counts the elements of each category. Without it the laps are no-ops.
+    def enable_stats(self, stats=None):
+            self.stats = stats or ConversionStats()
+            self.lap_start = time.perf_counter()
+            return self.stats
+
+    def start_laps(self):
+            if self.stats is not None:
+                self.stats.files += 1
+                self.lap_start = time.perf_counter()
+
+    def lap(self, stage):
+            #charge the time since the last lap to stage
+            if self.stats is not None:
+                now = time.perf_counter()
+                self.stats.add_time(stage, now - self.lap_start)
+                self.lap_start = now
+
+    def add_element_counts(self, counts):
+            #counts maps elements to how often they appeared. each distinct
+            #element is classified once.
+            for (element, number) in counts.items():
+                self.stats.count(self.stats_category(element), number)
+                self.stats.elements += number
+
+    def stats_category(self, element):
+            category = self.classify(element)[0]
+            if category == "dict_embellishment" and \
+                    not self.transpose_dict[element].startswith("{"):
+                #bar lines and part marks rather than embellishments
+                return "bar"
+            return category
+
+    def counted_elements(self, elements):
+            #pass elements through, counting them for the stats
+            counts = collections.Counter()
+            for element in elements:
+                counts[element] += 1
+                yield element
+            self.add_element_counts(counts)
+
+    def parse_text(self, file_text):
+            #returns the number of elements converted
+            elements = self.lex_text(file_text)
+            if self.stats is not None:
+                self.add_element_counts(collections.Counter(elements))
+                self.lap("stats")
+            with paused_gc():
+                for (self.position, element) in enumerate(elements):
+                    self.transpose(element)
+            self.finish_tune()
+            self.lap("transpose")
+            return len(elements)
+
+    def lex_text(self, file_text):
+            #read the metadata and return the bww elements of the tune
             file_text = self.stripNonPrintableCharacters(file_text);
+            self.lap("strip")
 
             file_text = self.get_and_strip_metadata(file_text);
+            self.lap("metadata")
 
             #get the tunes note info
             #greedy, multiline, from first ampersand to !I or 't (or just the end??)
-            notes_regex = re.compile("&.*",re.S)
-            result = notes_regex.search(file_text)
+            result = self.regex_notes.search(file_text)
             try:
                 tune_notes = result.group()
             except:
                 #no notes were found, what kind of file is this
                 self.quit("No notes were found.\nIs this a valid input file?")
             tune_notes = file_text;
-            # look for a bang with something after it that isn't in the dict
-            bang_no_space_regex = re.compile("(?<=\s)(?P<bang>!)(?P<nextpart>\S+)");
-            tune_notes = bang_no_space_regex.sub(self.replaceBadBang, tune_notes);
-                
-                
+            elements = self.split_elements(tune_notes)
+            self.lap("split")
+            return elements
 
-            #replace all whitespace characters with spaces
-            tune_notes = tune_notes.replace("\r"," ")
-            tune_notes = tune_notes.replace("\n"," ")
-            tune_notes = tune_notes.replace("\t"," ")
-
-            #split the string into it's constituents elements
+    def split_elements(self, tune_notes):
+            #split the string into it's constituents elements. split() takes
+            #any run of whitespace, newlines and tabs too, as one space
             elements = tune_notes.split()
-            for element in elements:
+            #look for a bang with something after it that isn't in the dict.
+            #only one after whitespace counts, which the first element
+            #isn't unless the text starts with some
+            bad = set([element for element in set(elements)
+                if element[0] == "!" and element not in self.bang_elements])
+            if not bad:
+                return elements
+            bad_bangs = [index for (index, element) in enumerate(elements) if element in bad]
+            if bad_bangs and bad_bangs[0] == 0 and not tune_notes[:1].isspace():
+                del bad_bangs[0]
+            fixed = []
+            start = 0
+            for index in bad_bangs:
+                element = elements[index]
+                fixed.extend(elements[start:index])
+                self.diagnostics.warn("bad_bang", (element, "! " + element[1:]), len(fixed),
+                    self.input_file_name)
+                fixed.extend(("!", element[1:]))
+                start = index + 1
+            fixed.extend(elements[start:])
+            return fixed
+
+    def finish_tune(self):
+            if self.slur_ties_pending:
+                self.warn("unmatched_tie")
+            self.position = None
+            self.diagnostics.finish(self.input_file_name)
+
+    def warn(self, code, *args):
+            #a warning about the element being converted
+            self.diagnostics.warn(code, args, self.position, self.input_file_name)
+
+    # Streaming conversion: the same steps as parse(), applied to the file
+    # a chunk and a line at a time so memory use doesn't grow with the file.
+    def read_chunks(self, chunk_size, report=False):
+            #yield the printable text of the input file one chunk at a time
+            for chunk in read_bww_chunks(self.original_file, chunk_size):
+                (filtered, dropped) = clean_bytes(chunk)
+                if report and dropped:
+                    report = False
+                    self.warn("non_printable")
+                yield filtered
+
+    def stream_quotes(self, chunks, replace_quote):
+            #substitute the quotes in a stream of text like get_and_strip_metadata,
+            #holding back a quote until it can't match any differently. no more
+            #than MAX_QUOTE_LENGTH is held back, so memory stays bounded
+            pending = ""
+            done = False
+            while not done:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    done = True
+                else:
+                    pending += chunk
+                pos = 0
+                while True:
+                    quote = pending.find('"', pos)
+                    if quote < 0:
+                        yield pending[pos:]
+                        pending = ""
+                        break
+                    if pending.find('"', quote+1, quote+1+MAX_QUOTE_LENGTH) < 0:
+                        if done and pending.find('"', quote+1) < 0:
+                            # never closed, so the rest is plain text
+                            yield pending[pos:]
+                            pending = ""
+                            break
+                        if done or len(pending) > quote+MAX_QUOTE_LENGTH:
+                            # too long for a quote, so a stray quote mark
+                            yield pending[pos:quote+1]
+                            pos = quote+1
+                            continue
+                        yield pending[pos:quote]
+                        pending = pending[quote:]
+                        break
+                    match = self.regex_quote.match(pending, quote)
+                    if not done and match.group("type") is None and \
+                            len(pending) <= match.end()+MAX_QUOTE_LENGTH:
+                        # the (type...) part may still be coming
+                        tail = pending[match.end():match.end()+3]
+                        if tail in ("", ",", ",(") or (tail[:2] == ",(" and "A" <= tail[2] <= "Z"):
+                            yield pending[pos:quote]
+                            pending = pending[quote:]
+                            break
+                    yield pending[pos:quote]
+                    yield replace_quote(match)
+                    pos = match.end()
+
+    def stream_lines(self, pieces, prefix=""):
+            #join a stream of text pieces and split it into lines
+            partial = [prefix]
+            for piece in pieces:
+                start = 0
+                newline = piece.find("\n")
+                while newline >= 0:
+                    partial.append(piece[start:newline+1])
+                    yield "".join(partial)
+                    partial = []
+                    start = newline+1
+                    newline = piece.find("\n", start)
+                partial.append(piece[start:])
+            yield "".join(partial)
+
+    def stream_strip_junk(self, lines):
+            #strip the "Other junk" line by line, like get_and_strip_metadata.
+            #a junk block runs up to the first close parens, which may be
+            #several lines later.
+            held = None
+            for line in lines:
+                line = self.regex_bagpipe.sub("", line)
+                if held is not None:
+                    held.append(line)
+                    close = line.find(")")
+                    if close >= 0:
+                        held = None
+                        yield line[close+1:]
+                    continue
+                match = self.regex_junk_keyword.match(line)
+                if not match:
+                    yield line
+                    continue
+                rest = line[match.end():]
+                if rest.startswith(","):
+                    close = rest.find(")")
+                    if close < 0:
+                        held = [rest]
+                        continue
+                    rest = rest[close+1:]
+                yield rest
+            if held is not None:
+                # no close parens before the end, so only the keywords go
+                yield held[0]
+                for line in held[1:]:
+                    match = self.regex_junk_keyword.match(line)
+                    yield line[match.end():] if match else line
+
+    def stream_placeholder(self, comment_element):
+            #the placeholder parse_quote() puts in the text, without
+            #collecting the metadata a second time
+            commentType = comment_element.group("type");
+            commentText = comment_element.group("content");
+            if commentType == "I" or commentType == "X" and commentText:
+                self.stream_comments += 1
+                return "comment" + str(self.stream_comments)
+            elif commentType == "T":
+                self.stream_titles += 1
+                return "header" + str(self.stream_titles)
+            return ""
+
+    def stream_raw_lines(self, chunk_size, prefix):
+            #yield the lines of the file with the quotes replaced
+            self.stream_comments = 0
+            self.stream_titles = 0
+            return self.stream_lines(
+                self.stream_quotes(self.read_chunks(chunk_size), self.stream_placeholder),
+                prefix)
+
+    def stream_time_sig(self, lines):
+            #pass lines through, taking the time signature from the first
+            #line that has one like get_and_strip_metadata
+            self.tune_time_sig = "C"
+            for line in lines:
+                result = self.sig_regex.search(line)
+                if result:
+                    self.tune_time_sig = result.group(1)+"/"+result.group(2)
+                    self.unparsed_time_sig = result.group(0);
+                    yield line
+                    break
+                yield line
+            for line in lines:
+                yield line
+
+    def stream_elements(self, lines):
+            #split the lines into elements, fixing up a bang with something
+            #after it that isn't in the dict like parse() does
+            text_before = False
+            position = 0
+            for line in lines:
+                for element in line.split():
+                    if element[0] == "!" and element not in self.bang_elements and \
+                            (text_before or line[0].isspace()):
+                        self.diagnostics.warn("bad_bang", (element, "! " + element[1:]), position,
+                            self.input_file_name)
+                        yield "!"
+                        yield element[1:]
+                        position += 2
+                    else:
+                        yield element
+                        position += 1
+                    text_before = True
+                text_before = text_before or bool(line)
+
+    def flush_tune_elements(self, file_handle, keep_notes):
+            #write out the start of the tune, keeping the last keep_notes
+            #notes so that slurs and dots can still reach back to them
+            if self.most_recent_note == 0:
+                return
+            if len(self.note_positions) < keep_notes:
+                return
+            if keep_notes:
+                index = self.note_positions[-keep_notes] - 1
+            else:
+                index = len(self.tune_elements) - 1
+            index = min(index, self.most_recent_note-1)
+            if index <= 0:
+                return
+            file_handle.write(render_elements(self.tune_elements[:index]))
+            del self.tune_elements[:index]
+            self.most_recent_note -= index
+            self.note_positions = [position - index
+                for position in self.note_positions if position >= index]
+
+    def write_tune(self, file_handle, elements, keep_notes=16, flush_size=1024):
+            #transpose elements, writing the abc out every flush_size elements.
+            #at least enough notes are kept for a slur with a two digit count
+            keep_notes = max(keep_notes, self.max_slur_notes + 1)
+            flush_at = flush_size
+            for (self.position, element) in enumerate(elements):
                 self.transpose(element)
+                if len(self.tune_elements) >= flush_at:
+                    self.flush_tune_elements(file_handle, keep_notes)
+                    flush_at = len(self.tune_elements) + flush_size
+            file_handle.write(render_elements(self.tune_elements))
+            self.tune_elements = []
 
-            if self.slur_ties_pending:
-                do_print("Unmatched tie start found.")
+    def stream_output_file(self, chunk_size=65536, keep_notes=16, flush_size=1024,
+            output_handle=None):
+            #convert the file like parse() and create_output_file() but
+            #write the abc out every flush_size elements.
+            #the file is read twice: once for the tune headers and once to
+            #transpose it. returns the path of the output file, or None when
+            #the abc went to output_handle
+            self.start_laps()
+            self.tune_title = []
+            self.tune_type = []
+            self.tune_author = []
+            self.tune_footer = []
+            for piece in self.stream_quotes(self.read_chunks(chunk_size, True), self.parse_quote):
+                pass
+            prefix = ""
+            if not self.tune_title:
+                self.tune_title.append(self.input_file_name);
+                prefix = "header1"
+
+            #the time signature and the notes are normally near the start
+            self.unparsed_time_sig = []
+            found_notes = False
+            lines = self.stream_raw_lines(chunk_size, prefix)
+            for line in self.stream_strip_junk(self.stream_time_sig(lines)):
+                found_notes = found_notes or "&" in line
+                if found_notes and self.unparsed_time_sig:
+                    break
+            if not found_notes:
+                #no notes were found, what kind of file is this
+                self.quit("No notes were found.\nIs this a valid input file?")
+            self.lap("metadata")
+
+            output_file = None
+            file_handle = output_handle
+            if file_handle is None:
+                output_file = self.output_path()
+                file_handle = OutputWriter(output_file, self.only_changed)
+            try:
+                file_handle.write(self.get_abc_header())
+                lines = self.stream_strip_junk(self.stream_raw_lines(chunk_size, prefix))
+                elements = self.stream_elements(lines)
+                if self.stats is not None:
+                    elements = self.counted_elements(elements)
+                self.write_tune(file_handle, elements, keep_notes, flush_size)
+            except BaseException:
+                if output_file is not None:
+                    file_handle.abort()
+                raise
+            if output_file is not None:
+                file_handle.commit()
+
+            self.finish_tune()
+            #reading, transposing and writing all happen together
+            self.lap("stream")
+            return output_file
+
+    def pipe(self, input_handle, output_handle, name="stdin", keep_notes=16, flush_size=1024):
+            #convert the bww read from input_handle, a binary file like
+            #sys.stdin.buffer, writing the abc to output_handle every
+            #flush_size elements. a pipe can't be read twice like
+            #stream_output_file() reads a file, so the input is read whole
+            self.reset()
+            self.diagnostics.clear()
+            self.input_file_name = name
+            self.start_laps()
+            file_data = normalize_newlines(decode_bom(input_handle.read()))
+            self.lap("read")
+            elements = self.lex_text(file_data)
+            if self.stats is not None:
+                self.add_element_counts(collections.Counter(elements))
+                self.lap("stats")
+            output_handle.write(self.get_abc_header())
+            with paused_gc():
+                self.write_tune(output_handle, elements, keep_notes, flush_size)
+            output_handle.flush()
+            self.finish_tune()
+            #transposing and writing happen together
+            self.lap("transpose")
 
     def abcnote(self,bwwname):
             #convert a bww notename to a abc notename
@@ -298,27 +1196,10 @@ class bwwtoabc :
             return abcnote
 
     def changenotevalue(self,time):
-            timeDict = {
-            "64":"1/8",
-            "32":"1/4",
-            "16":"1/2",
-            "8" :"1",
-            "4" :"2",
-            "2" :"4",
-            "1" :"8",
-            "0" :""
-            };
-            value = timeDict[time];
-            if time == "0":
-                do_print("Cannot parse the note with _0. Just using a value of 1.");
+            value = self.note_values[time];
             return value;
 
-    def parse_slur(self, slur_result):
-            #get the matching elements
-            note_count = slur_result.group("note_count")
-            end_note = slur_result.group("end_note")
-            start_stop = slur_result.group("start_stop");
-
+    def parse_slur(self, note_count, start_stop):
             # Don't parse until the end of the group.
             if start_stop == "s":
                 return;
@@ -333,26 +1214,75 @@ class bwwtoabc :
                 
 
             # find the position of the note that is slur_len from the end
-            #get the tune_elements lenght
-            elem_index = len(self.tune_elements)-1
-            note_count = 0
-            while note_count < slur_len:
-                element = self.tune_elements[elem_index]
-                #is this element a note?
-                is_note = self.regex_abcnote.search(element)
-                if is_note:
-                        #increment the note count
-                        note_count+=1
-                #decrease the element index
-                elem_index-=1
-
-            #add the slur start just after the start note
-            self.tune_elements.insert(elem_index+1,"(" + str(slur_len) + into_len)
-            # Move the most recent note index.
-            self.most_recent_note += 1;
+            if slur_len == 0:
+                elem_index = len(self.tune_elements)-1
+            elif slur_len <= len(self.note_positions):
+                elem_index = self.note_positions[-slur_len]-1
+            else:
+                #not enough notes yet, walk back the slow way
+                elem_index = len(self.tune_elements)-1
+                note_count = 0
+                while note_count < slur_len:
+                    if elem_index < -len(self.tune_elements):
+                        #longer than the notes there are, or than the notes
+                        #streaming still holds. a walk past the start goes
+                        #round from the end again, as it always has
+                        self.warn("slur_too_long", slur_len)
+                        self.tune_elements.append(" ")
+                        return
+                    element = self.tune_elements[elem_index]
+                    #is this element a note?
+                    is_note = self.regex_abcnote.search(str(element))
+                    if is_note:
+                            #increment the note count
+                            note_count+=1
+                    #decrease the element index
+                    elem_index-=1
+
+            #add the slur start just before the start note
+            if self.insert_before_element(elem_index+1, "(" + str(slur_len) + into_len):
+                # Move the most recent note index.
+                self.most_recent_note += 1;
             #add the slur end (just a space to separate);
             self.tune_elements.append(" ")
 
+    def insert_before_element(self, index, text):
+            #put text in front of tune_elements[index]. rather than inserting
+            #a new element, which shifts everything after it, the text goes
+            #on the end of the element before, so no index changes. for a
+            #beaming space that element is the most recent note, and the text
+            #goes in its suffix. the output is the same as long as whatever
+            #changes that element later only changes what is written before
+            #its suffix: a note's prefix and length, or the front of a string.
+            #returns True if it had to insert after all.
+            length = len(self.tune_elements)
+            if 0 < index < length:
+                self.append_to_element(index-1, text)
+                return False
+            self.tune_elements.insert(index, text)
+            #move the notes that are now one further along
+            if index < 0:
+                index = max(index + length, 0)
+            position = len(self.note_positions)-1
+            while position >= 0 and self.note_positions[position] >= index:
+                self.note_positions[position] += 1
+                position -= 1
+            return True
+
+    def append_to_element(self, index, text):
+            element = self.tune_elements[index]
+            if isinstance(element, Note):
+                element.suffix += text
+            else:
+                self.tune_elements[index] = element + text
+
+    def prepend_to_element(self, index, text):
+            element = self.tune_elements[index]
+            if isinstance(element, Note):
+                element.prefix = text + element.prefix
+            else:
+                self.tune_elements[index] = text + element
+
     def doublenote(self, note):
             doubleDict = {
             "ha": "{ag}",
@@ -406,9 +1336,7 @@ class bwwtoabc :
             doubling = doubleDict[note];
             return doubling;
             
-    def parsegrip(self, grip_result):
-            style = grip_result.group(1);
-            note = grip_result.group(2);
+    def parsegrip(self, style, note):
 
             grip = "{";
             # Initial grace note
@@ -443,10 +1371,7 @@ class bwwtoabc :
             
             return grip;
     
-    def parsepele(self, pele_result):
-            note = pele_result.group(3);
-            style = pele_result.group(2);
-            isLight = pele_result.group(1);
+    def parsepele(self, isLight, style, note):
             peleDict = {
                 "la"  :"{gAeAG}",
                 "b"   :"{gBeBG}",
@@ -489,12 +1414,7 @@ class bwwtoabc :
 
             return pele;
     
-    def parsestrike(self, strike_result):
-            islight = strike_result.group(1)
-            notetype = strike_result.group(2)
-            count = strike_result.group(3)
-            note = strike_result.group(4)
-
+    def parsestrike(self, islight, notetype, count, note):
             strikeDict = {
             "ha": "ag",
             "hg": "gf",
@@ -575,70 +1495,30 @@ class bwwtoabc :
 
     def dotmostrecentnote(self):
             if self.most_recent_note == 0:
-                do_print("This tune starts with a dot which will not be parsed.")
+                self.warn("dot_at_start")
                 return;
-            #add a dot to the last note
-            note = self.tune_elements[self.most_recent_note]
-
-            oldValue = self.get_note_value(note);
-
-            newValue = self.dot_note_value(oldValue);
-            self.tune_elements[self.most_recent_note] = \
-                self.tune_elements[self.most_recent_note].replace(oldValue,newValue);
+            #add a dot to the last note: half as long again
+            self.lengthen_most_recent_note(self.dot_length)
             return;
     def doubledotmostrecentnote(self):
             if self.most_recent_note == 0:
-                do_print("This tune starts with a double dot which will not be parsed.")
+                self.warn("doubledot_at_start")
                 return
-            #add a dot to the last note
-            note = self.tune_elements[self.most_recent_note]
-
-            oldValue = self.get_note_value(note);
-
-            newValue = self.doubledot_note_value(oldValue);
-            self.tune_elements[self.most_recent_note] = \
-                self.tune_elements[self.most_recent_note].replace(oldValue,newValue);
+            #add two dots to the last note: 1 + 1/2 + 1/4
+            self.lengthen_most_recent_note(self.doubledot_length)
             return;
 
-    def get_note_value(self, note):
-
-            value = re.search(r"[abcdefgAGB]([0-9]+(?:/[0-9]+)?)", note);
-            if value:
-                return value.group(1);
+    def lengthen_most_recent_note(self, factor):
+            note = self.tune_elements[self.most_recent_note]
+            if not isinstance(note, Note):
+                self.warn("no_note_value", str(note))
+                return
+            if note.duration is None:
+                #a note with no length is 1 long
+                note.set_duration(factor)
             else:
-                do_print("cant get value of " + note + " Using 1");
-
-    def dot_note_value(self, value):
-            valueDict = {
-            "1/8": "3/16", # 1/8 + 1/16
-            "1/4": "3/8",
-            "1/2": "3/4",
-            "1"  : "3/2",
-            "2"  : "3",
-            "3"  : "9/2", # 3 + 3/2 = 6/2 + 3/2 = 9/2
-            "4"  : "6",
-            "8"  : "12", # 8 + 4
-            "16" : "24", # 16 + 8
-            "3/2": "9/4", # 3/2 + 3/4 = 6/4 + 3/4
-            "3/4": "9/8", # 3/4 + 3/8 = 6/8 + 3/8
-            "3/8": "9/16", # 3/8 + 3/16 = 6/16 + 3/16
-            }
-            newValue = valueDict[value];
-            return newValue;
-
-    def doubledot_note_value(self, value):
-            valueDict = {
-            "1/8": "7/32", # 1/8 + 1/16 + 1/32
-            "1/4": "7/16", # 1/4 + 1/8 + 1/16
-            "1/2": "7/8",
-            "1"  : "7/4",
-            "2"  : "7/2",
-            "4"  : "7",
-            "8"  : "14",
-            "16" : "28",   # 16 + 8 + 4
-            }
-            newValue = valueDict[value];
-            return newValue;
+                note.set_duration(note.duration * factor)
+
     def format_tempo(self, tempoValue):
             fundamental_beat = "1/4"
             if self.unparsed_time_sig == "6_8":
@@ -648,7 +1528,7 @@ class bwwtoabc :
                 
     def format_header(self, headerNumber):
     
-            lpText = "\n\nX:" + str(headerNumber + 1) + "\n";
+            lpText = "\n\nX:" + str(headerNumber + 1 + self.tune_number_offset) + "\n";
 
             # Number of headers define length of this array. No need to check.
             thisTitle = self.tune_title[headerNumber]
@@ -658,13 +1538,13 @@ class bwwtoabc :
                 thisType = self.tune_type[headerNumber]
                 lpText += "R:" + thisType + "\n"
             else:
-                do_print("This file has more tune titles than tune types");
+                self.warn("missing_type")
             
             if len(self.tune_author) > headerNumber:
                 thisAuthor = self.tune_author[headerNumber];
                 lpText += "C:" + thisAuthor + "\n"
             else:
-                do_print("This file has more tune titles than tune composers");
+                self.warn("missing_composer")
             
             # TODO: put the footer below the tune using %%text 
             # With W: there seems to be a bug where footer is printed in the middle of the tune
@@ -675,7 +1555,7 @@ class bwwtoabc :
                 thisFooter = self.tune_footer[headerNumber]
                 lpText += "W:" + thisFooter + "\n"
             else:
-                do_print("This file has more tune titles than tune footers");
+                self.warn("missing_footer")
 
             # override beat length for 2/4 time.
             lpText += "L:1/8\n"
@@ -691,310 +1571,292 @@ class bwwtoabc :
                 # thisFooter,
                 # )
             return lpText;
+    def classify(self, element):
+            #sort a bww element into its category in a single step
+            fixed = self.fixed_elements.get(element)
+            if fixed:
+                return fixed
+            match = self.regex_element.match(element)
+            if match:
+                return (match.lastgroup, match)
+            return ("unparsed", None)
+
+    def resolve(self, element):
+            #turn a bww element into an action that doesn't depend on
+            #the state of the tune, eg ("append", "{gAd}")
+            embellishment = self.embellishments.get(element)
+            if embellishment is not None:
+                return ("append", embellishment)
+            return self.resolve_by_rules(element)
+
+    def resolve_by_rules(self, element):
+            #resolve without the embellishment table, which is made from this
+            (category, match) = self.classify(element)
+            return self.element_resolvers[category](element, match)
+
+    def cache_info(self):
+            #hits, misses, maxsize and currsize of the action cache
+            return self.resolve_cached.cache_info()
+
     def transpose(self,element):
             #receive a bww element and return a abc equivelent
+            action = self.resolve_cached(element)
+            self.action_handlers[action[0]](*action[1:])
+
+    # Resolvers: one per element category, each returns an action.
+    def resolve_note(self, element, match):
+            time = match.group("note_time")
+            pitch = self.abcnote( match.group("note_name") )
+            #only notes that look like abc notes can start a slur
+            counted = self.regex_abcnote.match(pitch) is not None
+            duration = self.changenotevalue(time)
+            return ("note", pitch, duration, format_length(duration),
+                match.group("note_dir"), time == "0", counted)
+
+    def resolve_grace(self, element, match):
+            grace = "{" + self.abcnote(match.group("grace_note")) + "}"
+            return ("append", grace)
+
+    def resolve_doublegrace(self, element, match):
+            grace = "{" + \
+                self.abcnote(match.group("doublegrace_first")) + \
+                self.abcnote(match.group("doublegrace_second")) + "}";
+            return ("append", grace)
+
+    def resolve_doubling(self, element, match):
+            doubling = self.doublenote(self.abcnote(match.group("doubling_note")))
+            return ("append", doubling)
+
+    def resolve_half_doubling(self, element, match):
+            half_doubling = self.halfdoublenote(self.abcnote(match.group("half_doubling_note")));
+            return ("append", half_doubling)
+
+    def resolve_thumb_doubling(self, element, match):
+            thumb_doubling = self.thumbdoublenote(self.abcnote(match.group("thumb_doubling_note")));
+            return ("append", thumb_doubling)
+
+    def resolve_single_strike(self, element, match):
+            strike = self.parsesinglestrike(match.group("single_strike_note"));
+            return ("append", strike)
+
+    def resolve_strike(self, element, match):
+            strike = self.parsestrike(match.group("strike_light"),
+                match.group("strike_type"),
+                match.group("strike_count"),
+                match.group("strike_note"));
+            return ("append", strike)
+
+    def resolve_grip(self, element, match):
+            grip = self.parsegrip(match.group("grip_style"), match.group("grip_note"));
+            return ("append", grip)
+
+    def resolve_pele(self, element, match):
+            pele = self.parsepele(match.group("pele_light"),
+                match.group("pele_style"),
+                match.group("pele_note"));
+            return ("append", pele)
+
+    def resolve_dot(self, element, match):
+            return ("dot",)
+
+    def resolve_doubledot(self, element, match):
+            return ("doubledot",)
+
+    def resolve_slur(self, element, match):
+            return ("slur", match.group("slur_count"), match.group("slur_start_stop"))
+
+    def resolve_tie(self, element, match):
+            return ("tie", element)
+
+    def resolve_comment(self, element, match):
+            #len comment == 8
+            return ("comment", int(element[7:])-1)
+
+    def resolve_header(self, element, match):
+            return ("header", int(element[6:])-1)
+
+    def resolve_tempo(self, element, match):
+            return ("tempo", match.group("tempo_value"))
+
+    def resolve_sub_repeat(self, element, match):
+            num_part = match.group("sub_repeat_num");
+
+            if int(num_part) > 10:
+                ending_number = str(int(int(num_part)/10));
+                ending_of = str(int(int(num_part)%10));                    
+                sub_repeat = "[\"" + ending_number + " of " + ending_of + "\" "
+            else:
+                sub_repeat = "|" + str(num_part) + " ";
 
-            #is the element a note?
-            note_result = self.regex_note_info.search(element)
-            if note_result:
-                note = self.abcnote( note_result.group("note") ) \
-                    + self.changenotevalue(note_result.group("time"))
-
-                if self.slur_tie_back:
-                    self.slur_tie_back=False
-                    note = "-" + note;
-
-                if note_result.group("dir") == None or note_result.group("dir") == "":
-                    self.tune_elements.insert(self.most_recent_note+1," ");
-                elif note_result.group("dir") == "r" and not self.in_note_group:
-                    self.in_note_group=True
-                    # The next note should be in a group.
-                    self.tune_elements.insert(self.most_recent_note+1," ");
-                elif note_result.group("dir") == "l":
-                    if self.in_note_group:
-                        self.in_note_group=False
-                
-                    
-                    
-                self.tune_elements.append(note)
-                self.most_recent_note = len(self.tune_elements)-1
+            return ("append", sub_repeat)
 
-                return
-            #is the element a grace note?
-            grace_result=self.regex_grace_note.search(element)
-            if grace_result:
-                grace = "{"+self.abcnote( grace_result.group(1) )+ "}"
-                self.tune_elements.append(grace)
-                return
-            double_grace_results = self.regex_doublegracenote.search(element);
-            if double_grace_results:
-                grace = "{" + \
-                    self.abcnote(double_grace_results.group(1)) + \
-                    self.abcnote(double_grace_results.group(2)) + "}";
-                self.tune_elements.append(grace);
-                return;
-            #is the element a doubling?
-            doubling_result=self.regex_doubling.search(element)
-            if doubling_result:
-                doubling = self.doublenote(self.abcnote( doubling_result.group(1) ))
-                self.tune_elements.append(doubling)
-                return
-            #is the element a half doubling?
-            hdoubling_result=self.regex_half_doubling.search(element)
-            if hdoubling_result:
-                half_doubling = self.halfdoublenote(self.abcnote( hdoubling_result.group(1) ));
-                self.tune_elements.append(half_doubling)
-                return
-            #is the element a thumb doubling?
-            tdoubling_result=self.regex_thumb_doubling.search(element)
-            if tdoubling_result:
-                thumb_doubling = self.thumbdoublenote(self.abcnote( tdoubling_result.group(1) ));
-                self.tune_elements.append(thumb_doubling)
-                return                
-            #is the element a strike?
-            single_strike_result=self.regex_single_strike.search(element)
-            if single_strike_result:
-                strike = self.parsesinglestrike(single_strike_result.group(1));
-                self.tune_elements.append(strike);
-                return
-            strike_result=self.regex_strike.search(element)
-            if strike_result:
-                strike = self.parsestrike(strike_result);
-                self.tune_elements.append(strike);
-                return
+    def resolve_ignore(self, element, match):
+            return ("ignore",)
 
-            grip_result = self.regex_grip.search(element);
-            if grip_result:
-                grip = self.parsegrip(grip_result);
-                self.tune_elements.append(grip);
-                return
-            pele_result = self.regex_pele.search(element);
-            if pele_result:
-                pele = self.parsepele(pele_result);
-                self.tune_elements.append(pele);
-                return;
-                
-            #is the element a dot?
-            dot_result=self.regex_dot.search(element)
-            if dot_result:
-                self.dotmostrecentnote();
-                return
-            dot_result=self.regex_doubledot.search(element)
-            if dot_result:
-                self.doubledotmostrecentnote();
-                return
+    def resolve_time_sig(self, element, match):
+            return ("time_sig", match.group("sig"),
+                match.group("sig_num")+"/"+match.group("sig_den"))
 
-            #is the element a slur?
-            slur_result = self.regex_slur.search(element)
-            if slur_result:
-                self.parse_slur(slur_result);
-                return
+    def resolve_common_time(self, element, match):
+            return ("time_sig", element, "C")
 
-            #is this a bww tie slur?
-            if element == "^ts":
-                self.tune_elements.append("(");
-                # NEW FORMAT: tie after NEXT note
-                self.slur_ties_pending += 1;
-                return
-            elif element == "^te" and self.slur_ties_pending:
-                # Only parse ^te as an ending when we saw a start (^ts) 
-                # This maintains compatibility with the old format
-                self.slur_ties_pending -= 1;
-                self.tune_elements.append(")");
-                return;
-            elif element.startswith("^t"):
-                # OLD FORMAT (e.g. ^tc ^tla, ^te etc.) add tie BEFORE next note.
-                self.slur_tie_back = True;
-                return;
+    def resolve_cut_time(self, element, match):
+            return ("time_sig", element, "C|")
 
-            if element.startswith("comment"):
-                #len comment == 8
-                commentNumber = int(element[7:])-1;
-                commentToInsert = self.comments_list[commentNumber];
-                # See if this comment was on its own line.
-                if len(self.tune_elements) and ("\n" in self.tune_elements[-1]):
-                    # use a %%text  style comment
-                    formattedComment = "%%text " + commentToInsert + "\n"; 
-                else:
-                    # use a "^text" style comment
-                    formattedComment = "\"^" + commentToInsert + "\""; 
-                self.tune_elements.append(formattedComment);
-                return;
+    def resolve_fermat(self, element, match):
+            return ("fermat",)
 
-            if element.startswith("header"):
-                headerNumber = int(element[6:])-1;
-                headerToInsert = self.format_header(headerNumber);
-                self.tune_elements.append(headerToInsert);
-                return;
+    def resolve_sharp(self, element, match):
+            return ("append", "#")
 
-            if element.startswith("TuneTempo,"):
-                # TODO want to handle tempo changes. For now, let fall into unparsed.
-                tempoValue = re.search(r'[0-9]+', element);
-                if tempoValue:
-                    formattedTempo = self.format_tempo(tempoValue.group(0))
-                    self.tune_elements.append(formattedTempo);
-                    return;
+    def resolve_natural(self, element, match):
+            return ("append", "=")
 
-            #is the element the start of a sub_repeat?
-            sub_repeat_result = self.regex_sub_repeat.search(element)
-            if sub_repeat_result:
-                num_part = sub_repeat_result.group(1);
+    def resolve_flat(self, element, match):
+            return ("append", "_")
 
+    def resolve_echo(self, element, match):
+            echonote = "{" + self.abcnote(element[4:]) + "}";
+            return ("append", echonote)
 
-                if int(num_part) > 10:
-                    ending_number = str(int(int(num_part)/10));
-                    ending_of = str(int(int(num_part)%10));                    
-                    sub_repeat = "[\"" + ending_number + " of " + ending_of + "\" "
-                else:
-                    sub_repeat = "|" + str(num_part) + " ";
+    def resolve_previous_note_mark(self, element, match):
+            return ("mark_previous", self.previous_note_marks[element])
 
-                self.tune_elements.append(sub_repeat)
-                return
+    def resolve_next_note_mark(self, element, match):
+            return ("append", self.next_note_marks[element])
 
-        
-            #is the element in the ignore list?
-            if element in self.ignore_elements:
-                return
+    def resolve_dict_embellishment(self, element, match):
+            return ("append", self.transpose_dict[element])
 
-            #if the element is a start double,
-            #check if the previous element was a end double
-            # if len(self.tune_elements):
-            #     last_element = self.tune_elements[-1]
-            #     if element=="I!''" and last_element.find(":|"):
-            #             #replace the last element with a double double
-            #             self.tune_elements[-1] = ":|!\n|: "
-            #             return
-
-            #is this a time sig? or Common time or Cut time?
-            result = self.sig_regex.search(element)
-            if result:
-                if result.group(0) != self.unparsed_time_sig:
-                    self.tune_time_sig = result.group(1)+"/"+result.group(2);
-                    self.tune_elements.append("[M:" + self.tune_time_sig + "]");
-                    self.unparsed_time_sig = result.group(0);
-                return
+    def resolve_unparsed(self, element, match):
+            return ("unparsed", element)
 
-            if element == "C" or element == "c":
-                if element != self.unparsed_time_sig:
-                    self.unparsed_time_sig = element;
-                    self.tune_time_sig = "C";
-                    self.tune_elements.append("[M:C]");
-                return;
-            if element == "C_" or element == "c_":
-                if element != self.unparsed_time_sig:
-                    self.unparsed_time_sig = element;
-                    self.tune_time_sig = "C|";
-                    self.tune_elements.append("[M:C|]");
-                return;
+    # Action handlers: the parts of transposing that depend on the tune so far.
+    def apply_append(self, text):
+            self.tune_elements.append(text)
 
-            if element.startswith("fermat"):
-                self.tune_elements[-1] = "H" + self.tune_elements[-1]
-                return;
-            
-            if element.startswith("sharp") and not element in ["sharpf", "sharpc"]:
-                self.tune_elements.append("#");
-                return;            
-            if element.startswith("natural"):
-                self.tune_elements.append("=");
-                return;
-            if element.startswith("flat"):
-                self.tune_elements.append("_");
-                return;
-            if element.startswith("echo"):
-                echonote = "{" + self.abcnote(element[4:]) + "}";
-                self.tune_elements.append(echonote)
-                return;
+    def apply_note(self, pitch, duration, length, direction, zero_value, counted):
+            if zero_value:
+                self.warn("zero_value")
 
-            if element in ["pc", "pcb", "phcla"]:
-                # Crunluath 
-                self.tune_elements[self.most_recent_note] = "\"_C\"" + self.tune_elements[self.most_recent_note];
-                return;
+            note = Note(pitch, duration, length)
+            if self.slur_tie_back:
+                self.slur_tie_back=False
+                note.prefix = "-";
+                counted = False
 
-            if element in ["pt", "ptb", "phtla", "ptbrea"]:
-                # Toarluath
-                self.tune_elements[self.most_recent_note] = "\"_T\"" + self.tune_elements[self.most_recent_note];
-                return;
-            
-            if element in ["pl", "plb", "phlla"]:
-                # Lemluath
-                self.tune_elements[self.most_recent_note] = "\"_L\"" + self.tune_elements[self.most_recent_note];
-                return;
-
-            if element in ["pcmb", "pcmd", "pcmc"]:
-                # Crunluath a mach insert reversed c U+0186 - modified NEXT note
-                self.tune_elements.append("\"_\\u0186\"");
-                return;
+            if direction == "":
+                self.insert_before_element(self.most_recent_note+1, " ");
+            elif direction == "r" and not self.in_note_group:
+                self.in_note_group=True
+                # The next note should be in a group.
+                self.insert_before_element(self.most_recent_note+1, " ");
+            elif direction == "l":
+                if self.in_note_group:
+                    self.in_note_group=False
 
-            if element in ["ptmb", "ptmc", "ptmd"]:
-                # Taorluath a machs Insert an up tack U+22A5 
-                self.tune_elements.append("\"_\\u22A5\"");
-                return;
+            self.tune_elements.append(note)
+            self.most_recent_note = len(self.tune_elements)-1
+            if counted:
+                self.note_positions.append(self.most_recent_note)
 
-            if element in ["pclg"]:
-                # Want a sideways C... this is the closest I found
-                self.tune_elements[self.most_recent_note] = "\"_\\u1D12\"" + self.tune_elements[self.most_recent_note];
-                return;
+    def apply_dot(self):
+            self.dotmostrecentnote();
 
-            if element in ["ptlg"]:
-                # right tack - i dont know what this is
-                self.tune_elements[self.most_recent_note] = "\"_\\u22A2\"" + self.tune_elements[self.most_recent_note];
-                return;
+    def apply_doubledot(self):
+            self.doubledotmostrecentnote();
 
-            if element in ["ptriplg", "ptripla", "ptripb", "ptripc"]:
-                # G gracenote triplings Insert a triple bar U+22A6A
-                self.tune_elements.append("\"_\\u2261\"");
-                return;
+    def apply_slur(self, note_count, start_stop):
+            self.parse_slur(note_count, start_stop);
 
-            if element in ["pembari", "pendari", "phiharin", "pdare", "penbain", "potro", "podro", "pedre"]:
-                # add a mordent (squiggle) on NEXT note
-                self.tune_elements.append("P");
-                return;
+    def apply_tie(self, element):
+            #is this a bww tie slur?
+            if element == "^ts":
+                self.tune_elements.append("(");
+                # NEW FORMAT: tie after NEXT note
+                self.slur_ties_pending += 1;
+            elif element == "^te" and self.slur_ties_pending:
+                # Only parse ^te as an ending when we saw a start (^ts) 
+                # This maintains compatibility with the old format
+                self.slur_ties_pending -= 1;
+                self.tune_elements.append(")");
+            else:
+                # OLD FORMAT (e.g. ^tc ^tla, ^te etc.) add tie BEFORE next note.
+                self.slur_tie_back = True;
 
-            if element in ["padeda"]:
-                # add a mordent (squiggle) on PREVIOUS note
-                self.tune_elements[self.most_recent_note] = "P" + self.tune_elements[self.most_recent_note];
-                return
+    def apply_comment(self, commentNumber):
+            commentToInsert = self.comments_list[commentNumber];
+            # See if this comment was on its own line.
+            if len(self.tune_elements) and ("\n" in str(self.tune_elements[-1])):
+                # use a %%text  style comment
+                formattedComment = "%%text " + commentToInsert + "\n"; 
+            else:
+                # use a "^text" style comment
+                formattedComment = "\"^" + commentToInsert + "\""; 
+            self.tune_elements.append(formattedComment);
 
-            if element in ["pdili", "ptra", "phtra", "ptra8", "pgrp"]:
-                # add a trill (tr)
-                self.tune_elements.append("!trill!");
-                return
-                
-            if element in ["pchedari", "phedari"]:
-                self.tune_elements.append("!turn!");
-                return;
+    def apply_header(self, headerNumber):
+            headerToInsert = self.format_header(headerNumber);
+            self.tune_elements.append(headerToInsert);
 
-            if element in ["pdarodo", "pdarodo16", "phdarodo"]:
-                # add a turn??? modifies NEXT note
-                self.tune_elements.append("!turn!");
-                return
+    def apply_tempo(self, tempoValue):
+            # TODO want to handle tempo changes.
+            formattedTempo = self.format_tempo(tempoValue)
+            self.tune_elements.append(formattedTempo);
 
-            try:
-                # Lookup everything else in the dictionary.
-                dict_result = self.transpose_dict[element]
-                if dict_result:
-                    self.tune_elements.append(dict_result)
-                    return;
-            except:
-                do_print( "unparsed: " + element)
-                self.tune_elements.append("[r:unparsedBWW " + element + "]");
+    def apply_ignore(self):
             return
 
+    def apply_time_sig(self, unparsed_time_sig, time_sig):
+            if unparsed_time_sig != self.unparsed_time_sig:
+                self.unparsed_time_sig = unparsed_time_sig;
+                self.tune_time_sig = time_sig;
+                self.tune_elements.append("[M:" + time_sig + "]");
+
+    def apply_fermat(self):
+            self.prepend_to_element(-1, "H")
+            self.uncount_note(len(self.tune_elements)-1)
+
+    def apply_mark_previous(self, text):
+            self.prepend_to_element(self.most_recent_note, text);
+            self.uncount_note(self.most_recent_note)
+
+    def uncount_note(self, index):
+            #a note with something in front of it can't start a slur
+            if self.note_positions and self.note_positions[-1] == index:
+                self.note_positions.pop()
+
+    def apply_unparsed(self, element):
+            self.warn("unparsed", element)
+            self.tune_elements.append("[r:unparsedBWW " + element + "]");
+
     #handle writing the output
     def create_output_file(self):
+            #render the abc a piece at a time as it is written, rather than
+            #joining all of it first
+            output_file = self.output_path()
+            with OutputWriter(output_file, self.only_changed) as writer:
+                writer.write(self.get_abc_header())
+                for text in render_chunks(self.tune_elements):
+                    writer.write(text)
+            self.lap("write")
+            return output_file
+
+    def output_path(self):
+            return os.path.join(self.file_dir, self.output_file_name)
+
+    def write_output_file(self, text):
             #determine the output file
-            output_file = os.path.join(self.file_dir, self.output_file_name)
-            #open the file for writing
-            file_handle = open(output_file,"w")
+            output_file = self.output_path()
             #write the data to the file
-            text = self.get_abc_text()
-            file_handle.write(text)
-            #close the handle
-            file_handle.close()
+            with OutputWriter(output_file, self.only_changed) as writer:
+                writer.write(text)
             #return the string of the path to the file
             return output_file
 
     def set_file(self, file_path, output):
+            self.reset()
+            self.diagnostics.clear()
             #determine the absolute path to the file
             if os.path.isfile(file_path):
                 abs_file = file_path;
@@ -1009,7 +1871,7 @@ class bwwtoabc :
                 self.original_file = abs_file
                 self.file_dir = os.path.dirname(abs_file)
             else:
-                raise Exception(abs_file + " is not a file")
+                raise ConversionError(abs_file + " is not a file")
             
             if output:
                 potentialPath = os.path.dirname(output);
@@ -1028,16 +1890,41 @@ class bwwtoabc :
 
 
     def quit(self,string=""):
-            if string!="":
-                do_print(string)
-            sys.exit()
+            #stop converting, the caller decides whether to exit
+            raise ConversionError(string)
+
+    def convert(self, bww_text, name="untitled.bww"):
+            #convert bww text or bytes, read_bww() or not, to abc text
+            #without touching the disk.
+            #name is used for the "% File:" line and a missing title.
+            self.reset()
+            self.diagnostics.clear()
+            self.input_file_name = name
+            self.start_laps()
+            #the byte order mark and newline handling read_bww() gives files
+            if isinstance(bww_text, str):
+                if bww_text.startswith("\ufeff"):
+                    bww_text = bww_text[1:]
+                if "\r" in bww_text:
+                    bww_text = bww_text.replace("\r\n", "\n").replace("\r", "\n")
+            else:
+                bww_text = normalize_newlines(decode_bom(bww_text))
+            self.parse_text(bww_text)
+            text = self.get_abc_text()
+            self.lap("abc_text")
+            return text
 
     def get_abc_text(self):
-            tune_text = "".join(self.tune_elements)
-            
+            tune_text = render_elements(self.tune_elements)
+            lptext = self.get_abc_header() + tune_text;
+            return lptext
+
+    def get_abc_header(self):
+            return "% File: " + self.input_file_name + "\n" + self.get_abc_directives()
+
+    def get_abc_directives(self):
             # These directives should all work with abcm2ps.
-            abcFormattingHeader  = "% File: " + self.input_file_name + "\n"
-            abcFormattingHeader += "%%flatbeams     1\n"
+            abcFormattingHeader  = "%%flatbeams     1\n"
             abcFormattingHeader += "%%straightflags 1\n"
             abcFormattingHeader += "%%landscape     1\n"
             abcFormattingHeader += "%%breaklimit    1.0\n"
@@ -1046,18 +1933,271 @@ class bwwtoabc :
             abcFormattingHeader += "%%notespacingfactor 1.0\n"
             abcFormattingHeader += "%%leftmargin    1.0cm\n"
             abcFormattingHeader += "%%rightmargin   1.0cm\n"
-
-            lptext = abcFormattingHeader + tune_text;
-
-            return lptext
+            return abcFormattingHeader
+
+#where a conversion server started with --server listens
+def server_socket_path():
+    path = os.environ.get("BWW2ABC_SOCKET")
+    if not path and hasattr(os, "getuid"):
+        #what tempfile.gettempdir() finds, without importing tempfile
+        temp_dir = os.environ.get("TMPDIR") or os.environ.get("TEMP") or \
+            os.environ.get("TMP") or "/tmp"
+        path = os.path.join(temp_dir, "bww2abc-%d.sock" % os.getuid())
+    return path
+
+#convert bww text to abc text in memory. To convert many tunes, reuse
+#one bwwtoabc and call its convert() method instead.
+def convert_text(bww_text, name="untitled.bww"):
+    return bwwtoabc().convert(bww_text, name)
+
+#convert through pipes: "-" as the input reads stdin and "-" as the output
+#writes stdout, where a pipeline wants them instead of temporary files.
+#warnings go to stderr, out of the way of the abc
+def convert_pipe(converter, input_file, output, stream=False):
+    #returns the output file, or None when the abc went to stdout
+    import contextlib
+    output_handle = sys.stdout
+    if output and output != "-":
+        output_handle = OutputWriter(output, converter.only_changed)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            if input_file == "-":
+                converter.pipe(sys.stdin.buffer, output_handle)
+            elif stream:
+                converter.set_file(input_file, None)
+                converter.stream_output_file(output_handle=output_handle)
+            else:
+                converter.set_file(input_file, None)
+                input_handle = open(converter.original_file, "rb")
+                try:
+                    converter.pipe(input_handle, output_handle, converter.input_file_name)
+                finally:
+                    input_handle.close()
+    except BaseException:
+        if output_handle is not sys.stdout:
+            output_handle.abort()
+        raise
+    if output_handle is not sys.stdout:
+        output_handle.commit()
+    if output_handle is sys.stdout:
+        return None
+    return output
+
+#batch conversion of many files
+def find_input_files(paths, out_dir=None, keep_dirs=False):
+    #expand files, directories and globs into (input file, output) pairs.
+    #the output is None to write next to the input, otherwise a path in out_dir.
+    #with keep_dirs a relative file path keeps its directories in out_dir,
+    #as the files of a directory do
+    found = []
+    seen = set()
+    def add(input_file, relative_name):
+        key = os.path.abspath(input_file)
+        if key in seen:
+            return
+        seen.add(key)
+        output = None
+        if out_dir:
+            output = os.path.join(out_dir,
+                os.path.splitext(relative_name)[0] + ".abc")
+        found.append((input_file, output))
+
+    for path in paths:
+        if os.path.isdir(path):
+            for (dir_path, dir_names, file_names) in os.walk(path):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if file_name.lower().endswith(".bww"):
+                        input_file = os.path.join(dir_path, file_name)
+                        add(input_file, os.path.relpath(input_file, path))
+        elif any(c in path for c in "*?["):
+            import glob
+            for input_file in sorted(glob.glob(path, recursive=True)):
+                if os.path.isfile(input_file):
+                    add(input_file, os.path.basename(input_file))
+        elif keep_dirs and not os.path.isabs(path) and \
+                not os.path.normpath(path).startswith(os.pardir):
+            add(path, os.path.normpath(path))
+        else:
+            add(path, os.path.basename(path))
+    return found
+
+def read_file_list(file_handle):
+    #the paths in a binary file of paths, one per line or separated by NULs
+    #as find -print0 writes them
+    data = file_handle.read()
+    if b"\0" in data:
+        names = data.split(b"\0")
+    else:
+        names = data.replace(b"\r\n", b"\n").split(b"\n")
+    return [os.fsdecode(name) for name in names if name.strip()]
+
+#the converter convert_file() reuses in this process
+file_converter = None
+
+def shared_converter():
+    #one converter for every file a process converts, so its tables and
+    #its cache of resolved elements are made once
+    global file_converter
+    if file_converter is None:
+        file_converter = bwwtoabc()
+    return file_converter
+
+def convert_file(input_file, output=None, stream=False, cache=None, stats=None,
+        diagnostics=None, only_changed=False):
+    #convert one file with the shared converter, using cache if it is a
+    #bww2abc_cache.ConversionCache, recording into stats if it is a
+    #ConversionStats and showing warnings like diagnostics, a Diagnostics.
+    #with only_changed an output with the same abc isn't rewritten.
+    #returns (input_file, output_file, error message or None)
+    try:
+        if output:
+            output_dir = os.path.dirname(output)
+            if output_dir and not os.path.isdir(output_dir):
+                os.makedirs(output_dir, exist_ok=True)
+        converter = shared_converter()
+        converter.stats = None
+        if stats is not None:
+            converter.enable_stats(stats)
+        converter.diagnostics = diagnostics.copy() if diagnostics is not None else Diagnostics()
+        converter.only_changed = only_changed
+        converter.set_file(input_file, output)
+        if cache is not None:
+            import bww2abc_cache
+            return (input_file, bww2abc_cache.convert_cached(converter, cache, stream), None)
+        if stream:
+            return (input_file, converter.stream_output_file(), None)
+        converter.parse()
+        return (input_file, converter.create_output_file(), None)
+    except ConversionError as e:
+        return (input_file, None, str(e))
+    except Exception as e:
+        return (input_file, None, "%s: %s" % (e.__class__.__name__, e))
+
+def convert_file_stats(input_file, output=None, stream=False, cache=None, diagnostics=None,
+        only_changed=False):
+    #convert_file() in a worker process, returning the stats with the result
+    stats = ConversionStats()
+    return (convert_file(input_file, output, stream, cache, stats, diagnostics, only_changed),
+        stats)
+
+def convert_files(paths, out_dir=None, jobs=None, stream=False, cache=None, stats=None,
+        diagnostics=None, keep_dirs=False, only_changed=False):
+    #convert every file found in paths using a pool of jobs processes.
+    #returns a list of convert_file results.
+    results = convert_found_files(find_input_files(paths, out_dir, keep_dirs), jobs, stream,
+        cache, stats, diagnostics, only_changed)
+    if cache is not None:
+        cache.trim()
+    return results
+
+def convert_found_files(files, jobs=None, stream=False, cache=None, stats=None,
+        diagnostics=None, only_changed=False):
+    #convert a list of (input file, output) pairs. the largest files are
+    #scheduled first so a big file doesn't finish alone at the end of the run.
+    #stats, if given, gets the stats of every file and the wall time.
+    start = time.perf_counter()
+    def size(item):
+        try:
+            return os.path.getsize(item[0])
+        except OSError:
+            return 0
+    files.sort(key=size, reverse=True)
+    if diagnostics is None and len(files) > 1:
+        diagnostics = Diagnostics(show_names=True)
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(files)))
+    if jobs == 1:
+        results = [convert_file(input_file, output, stream, cache, stats, diagnostics,
+                only_changed)
+            for (input_file, output) in files]
+    elif stats is None:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(convert_file, input_file, output, stream, cache,
+                    None, diagnostics, only_changed)
+                for (input_file, output) in files]
+            results = [future.result() for future in futures]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(convert_file_stats, input_file, output, stream, cache,
+                    diagnostics, only_changed)
+                for (input_file, output) in files]
+            results = []
+            for future in futures:
+                (result, file_stats) = future.result()
+                stats.merge(file_stats)
+                results.append(result)
+    if stats is not None:
+        stats.wall_time += time.perf_counter() - start
+    return results
 
 #use the bww2abc class
 if __name__ == "__main__" :
-    parser = OptionParser()
-    parser.add_option("-i", "--in", dest="input",
-            help="the FILE to convert", metavar="FILE")
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options] [FILE|DIR|GLOB ...]")
+    parser.add_option("-i", "--in", dest="input", default=[], action="append",
+            help="the FILE to convert, can be given more than once. - reads "
+            "stdin and writes stdout unless -o is given", metavar="FILE")
     parser.add_option("-o", "--out", dest="output",
-            help="the OUTFILE name", metavar="OUTFILE")
+            help="the OUTFILE name, - for stdout", metavar="OUTFILE")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=None,
+            help="convert the FILE, DIR and GLOB arguments with N processes "
+            "(default: one per core)", metavar="N")
+    parser.add_option("--out-dir", dest="out_dir",
+            help="write batch outputs into DIR instead of next to each input", metavar="DIR")
+    parser.add_option("--files-from", dest="files_from", default=None,
+            help="also convert the files listed in LIST, one per line or "
+            "separated by NULs like find -print0 writes them. - reads stdin", metavar="LIST")
+    parser.add_option("--book", dest="book", default=None,
+            help="convert every FILE, DIR and GLOB into the one abc BOOK, with the "
+            "tunes numbered through the book and an index of them in BOOK.idx",
+            metavar="BOOK")
+    parser.add_option("--scan", dest="scan", default=None,
+            help="don't convert, but put the titles, types, composers, tempo and "
+            "element counts of the FILE, DIR and GLOB arguments into the sqlite "
+            "CATALOG, rescanning only the files that changed", metavar="CATALOG")
+    parser.add_option("--stream", dest="stream", default=False, action="store_true",
+            help="write the output while reading the input, for very large files")
+    parser.add_option("--split-tunes", dest="split_tunes", default=False, action="store_true",
+            help="convert the tunes of the -i FILE in parallel with --jobs processes, "
+            "for collections of many tunes")
+    parser.add_option("--only-changed", dest="only_changed", default=False,
+            action="store_true",
+            help="don't rewrite outputs that already have the same abc, so their "
+            "modification times stay")
+    parser.add_option("--stats", dest="stats", default=None, choices=["json", "text"],
+            help="print the time spent in each stage and the number of elements "
+            "of each kind to stderr, as json or text", metavar="FORMAT")
+    parser.add_option("--warnings", dest="warnings", default="each",
+            choices=["each", "summary", "json"],
+            help="show each warning as it happens, a summary of each kind of "
+            "warning with a count, or json lines (default: each)", metavar="FORMAT")
+    parser.add_option("-q", "--quiet", dest="quiet", default=False, action="store_true",
+            help="don't show warnings")
+    parser.add_option("--max-warnings", dest="max_warnings", type="int", default=None,
+            help="show at most N warnings for each file", metavar="N")
+    parser.add_option("--cache", dest="cache", default=None,
+            help="keep finished conversions in DIR and reuse them for "
+            "unchanged files", metavar="DIR")
+    parser.add_option("--cache-size", dest="cache_size", type="int", default=512,
+            help="the most the --cache directory may hold (default: 512)", metavar="MB")
+    parser.add_option("--watch", dest="watch", default=None,
+            help="keep converting the bww files in DIR as they change, and "
+            "remove the outputs of deleted ones", metavar="DIR")
+    parser.add_option("--interval", dest="interval", type="float", default=1.0,
+            help="how often --watch looks for changes (default: 1)", metavar="SECONDS")
+    parser.add_option("--server", dest="server", default=False, action="store_true",
+            help="keep running and convert files for other bww2abc commands, "
+            "with --jobs processes")
+    parser.add_option("--socket", dest="socket", default=None,
+            help="the socket the server listens on (default: $BWW2ABC_SOCKET "
+            "or a per-user socket in the temp directory)", metavar="PATH")
+    parser.add_option("--no-server", dest="no_server", default=False, action="store_true",
+            help="convert in this process even if a server is running")
     parser.add_option("-v","--version",dest='version',default=False,
             action="store_true",help="print version information and quit")
 
@@ -1067,13 +2207,150 @@ if __name__ == "__main__" :
             do_print( "bwwtoabc: "+version)
             sys.exit()
 
-    if options.input != None:
+    #files listed by --files-from are converted with the other arguments
+    listed = []
+    if options.files_from == "-":
+            listed = read_file_list(sys.stdin.buffer)
+    elif options.files_from:
+            file_handle = open(options.files_from, "rb")
+            listed = read_file_list(file_handle)
+            file_handle.close()
+    single_input = None
+    if len(options.input) == 1 and not args and not options.files_from and \
+            not options.book and not options.scan:
+            single_input = options.input[0]
+    elif options.output and (options.input or args or options.files_from):
+            parser.error("-o needs a single -i FILE, use --out-dir for many files")
+
+    socket_path = options.socket or server_socket_path()
+    stats = None
+    if options.stats:
+            stats = ConversionStats()
+    def print_stats():
+        if options.stats == "json":
+            import json
+            sys.stderr.write(json.dumps(stats.as_dict(), indent=1, sort_keys=True) + "\n")
+        elif options.stats:
+            sys.stderr.write(stats.format_text() + "\n")
+    diagnostics = Diagnostics("quiet" if options.quiet else options.warnings,
+        options.max_warnings)
+    cache = None
+    if options.cache:
+            import bww2abc_cache
+            cache = bww2abc_cache.ConversionCache(options.cache,
+                options.cache_size * 1024 * 1024)
+    if options.server:
+            import bww2abc_server
+            bww2abc_server.serve(socket_path, options.jobs)
+    elif options.watch:
+            import bww2abc_watch
+            diagnostics.show_names = True
+            try:
+                bww2abc_watch.watch(options.watch, options.out_dir, options.interval,
+                    options.jobs, options.stream, cache, diagnostics, options.only_changed)
+            except KeyboardInterrupt:
+                pass
+    elif single_input is not None:
             converter = bwwtoabc()
-            converter.set_file(options.input, options.output)
-            converter.parse()
-            new_file = converter.create_output_file()
+            if stats is not None:
+                converter.enable_stats(stats)
+            converter.diagnostics = diagnostics
+            converter.only_changed = options.only_changed
+            if options.out_dir and not options.output and single_input != "-":
+                #where the batch path would put it
+                os.makedirs(options.out_dir, exist_ok=True)
+                options.output = os.path.join(options.out_dir,
+                    os.path.splitext(os.path.basename(single_input))[0] + ".abc")
+            if single_input == "-" or options.output == "-":
+                try:
+                    convert_pipe(converter, single_input, options.output, options.stream)
+                except ConversionError as e:
+                    sys.stderr.write(str(e) + "\n")
+                    sys.exit(1)
+                print_stats()
+                sys.exit()
+            try:
+                converter.set_file(single_input, options.output)
+            except ConversionError as e:
+                do_print(str(e))
+                sys.exit(1)
+            if options.split_tunes:
+                import bww2abc_split
+                try:
+                    bww2abc_split.convert_split(single_input, options.output,
+                        options.jobs, stats, diagnostics)
+                except ConversionError as e:
+                    do_print(str(e))
+                print_stats()
+                sys.exit()
+            if cache is not None:
+                try:
+                    bww2abc_cache.convert_cached(converter, cache, options.stream)
+                except ConversionError as e:
+                    do_print(str(e))
+                cache.trim()
+                print_stats()
+                sys.exit()
+            if not options.stream and not options.no_server and not stats and \
+                    not diagnostics.settings() and \
+                    socket_path and os.path.exists(socket_path):
+                # a warm server is much faster than a cold start
+                import bww2abc_server
+                result = bww2abc_server.convert_with_server(converter, socket_path)
+                if result is not None:
+                    (new_file, error) = result
+                    if error:
+                        do_print(error)
+                    sys.exit()
+            try:
+                if options.stream:
+                    new_file = converter.stream_output_file()
+                else:
+                    converter.parse()
+                    new_file = converter.create_output_file()
+            except ConversionError as e:
+                do_print(str(e))
+                print_stats()
+                sys.exit()
+            print_stats()
             # Print the output file name.
             # do_print(new_file)
+    elif options.input or args or options.files_from:
+            files = find_input_files(options.input + args, options.out_dir)
+            seen = set(os.path.abspath(input_file) for (input_file, output) in files)
+            files += [(input_file, output) for (input_file, output) in
+                find_input_files(listed, options.out_dir, keep_dirs=True)
+                if os.path.abspath(input_file) not in seen]
+            diagnostics.show_names = len(files) > 1
+            failed = 0
+            if options.scan:
+                import bww2abc_scan
+                (scanned, unchanged, removed, scan_failed) = bww2abc_scan.update_catalog(
+                    options.scan, [input_file for (input_file, output) in files])
+                for (input_file, error) in scan_failed:
+                    failed += 1
+                    do_print("failed: " + input_file + ": " + error)
+                do_print("scanned %d files, %d unchanged, %d removed" %
+                    (scanned, unchanged, removed))
+            elif options.book:
+                import bww2abc_book
+                for (input_file, error) in bww2abc_book.write_book(
+                        [input_file for (input_file, output) in files], options.book,
+                        options.jobs, stats, diagnostics):
+                    failed += 1
+                    do_print("failed: " + input_file + ": " + error)
+            else:
+                for (input_file, output_file, error) in \
+                        convert_found_files(files, options.jobs, options.stream, cache,
+                            stats, diagnostics, options.only_changed):
+                    if error:
+                        failed += 1
+                        do_print("failed: " + input_file + ": " + error)
+            if cache is not None:
+                cache.trim()
+            print_stats()
+            if failed:
+                sys.exit(1)
     else:
         parser.print_help()
-sys.exit()
+    sys.exit()
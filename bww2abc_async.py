@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+#bww2abc_async: converts bww files from asyncio code without blocking the
+#event loop.
+#copyright: 2018
+#GPL v3
+#
+#  async for (input_file, output_file, error) in convert_many(paths, concurrency=4):
+#      ...
+#
+#The files are read and the abc written in the loop's default thread pool
+#and converted in an executor, a pool of processes unless one is given. At
+#most concurrency files are in flight at a time, and no more are started
+#while concurrency results are waiting for the caller to take them.
+
+import os, asyncio, threading
+import bww2abc
+
+#the converter of each thread of each worker process
+worker = threading.local()
+
+def convert_data(item):
+    #runs in the executor. item is (bww bytes from read_bww(), file name).
+    #returns (abc text, warning events, error message or None)
+    (data, name) = item
+    converter = getattr(worker, "converter", None)
+    if converter is None:
+        converter = worker.converter = bww2abc.bwwtoabc()
+        #the warnings are shown by the event loop
+        converter.diagnostics = bww2abc.Diagnostics("collect")
+    try:
+        abc = converter.convert(data, name)
+    except bww2abc.ConversionError as e:
+        return (None, list(converter.diagnostics.events), str(e))
+    except Exception as e:
+        return (None, list(converter.diagnostics.events), "%s: %s" % (e.__class__.__name__, e))
+    return (abc, list(converter.diagnostics.events), None)
+
+def output_path(input_file, output=None):
+    #where convert_file() would write the abc of input_file, output being
+    #a file or None as find_input_files() gives them
+    if output:
+        return output
+    return os.path.splitext(input_file)[0] + ".abc"
+
+def write_output(path, text, only_changed=False):
+    #atomically, like the converter writes its outputs
+    output_dir = os.path.dirname(path)
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    with bww2abc.OutputWriter(path, only_changed) as writer:
+        writer.write(text)
+
+async def convert_one(input_file, output, executor, diagnostics, only_changed=False):
+    #convert one file. returns (input file, output file, error message or None)
+    loop = asyncio.get_running_loop()
+    name = os.path.basename(input_file)
+    try:
+        if not os.path.isfile(input_file):
+            raise bww2abc.ConversionError(os.path.abspath(input_file) + " is not a file")
+        data = await loop.run_in_executor(None, bww2abc.read_bww, input_file)
+        (abc, events, error) = await loop.run_in_executor(executor, convert_data, (data, name))
+        diagnostics.replay(events, name=name)
+        diagnostics.finish(name)
+        if error:
+            return (input_file, None, error)
+        path = output_path(input_file, output)
+        await loop.run_in_executor(None, write_output, path, abc, only_changed)
+        return (input_file, path, None)
+    except bww2abc.ConversionError as e:
+        return (input_file, None, str(e))
+    except Exception as e:
+        return (input_file, None, "%s: %s" % (e.__class__.__name__, e))
+
+async def convert_many(paths, concurrency=None, executor=None, out_dir=None,
+        diagnostics=None, only_changed=False):
+    #yield (input file, output file, error message or None) for every bww
+    #file found in paths, as each is converted. executor is a
+    #concurrent.futures executor for the conversions. without one a pool of
+    #concurrency processes is made for the call. warnings are shown like
+    #diagnostics, a bww2abc.Diagnostics. with only_changed an output with
+    #the same abc isn't rewritten
+    loop = asyncio.get_running_loop()
+    if concurrency is None:
+        concurrency = os.cpu_count() or 1
+    concurrency = max(1, concurrency)
+    if diagnostics is None:
+        diagnostics = bww2abc.Diagnostics(show_names=True)
+    own_executor = executor is None
+    if own_executor:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=concurrency)
+    #find_input_files() walks directories, so it runs in a thread too
+    files = iter(await loop.run_in_executor(None, bww2abc.find_input_files, paths, out_dir))
+    results = asyncio.Queue(maxsize=concurrency)
+
+    async def convert_next():
+        #convert files until there are none left, then put None
+        for (input_file, output) in files:
+            await results.put(await convert_one(input_file, output, executor, diagnostics,
+                only_changed))
+        await results.put(None)
+
+    tasks = [asyncio.ensure_future(convert_next()) for i in range(concurrency)]
+    try:
+        running = len(tasks)
+        while running:
+            result = await results.get()
+            if result is None:
+                running -= 1
+            else:
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if own_executor:
+            await loop.run_in_executor(None, executor.shutdown)
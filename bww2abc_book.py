@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+#bww2abc_book: converts many bww files into one abc book, with an index of
+#where each tune is in it.
+#copyright: 2018
+#GPL v3
+#
+#The formatting directives are written once at the top of the book and the
+#X: fields are numbered across the whole book instead of from 1 in every
+#file. The abc of each file is written as soon as it is converted, in the
+#order of the files. Next to the book, in BOOK.idx, a json line for every
+#tune gives its number, title, source file and the byte offset and length
+#of its abc, so a reader can seek or mmap straight to a tune. Both are
+#written to temporary files that replace the old book and index only when
+#the book is complete, the index last.
+
+import os, re, json, mmap, time
+import bww2abc
+import bww2abc_split
+
+#the X: field that format_header() starts every tune with. titles and
+#comments are made one line, so nothing else starts a line with it
+regex_tune_start = re.compile(br"^X:(\d+)$", re.M)
+
+#the converter each worker process reuses
+worker_converter = None
+
+def index_path(book_path):
+    return book_path + ".idx"
+
+def convert_book_file(item):
+    #runs in a worker process. item is (input file, whether to keep stats).
+    #returns (abc of its tunes numbered from 1, their titles, warning
+    #events, stats or None, error message or None)
+    global worker_converter
+    (input_file, with_stats) = item
+    if worker_converter is None:
+        worker_converter = bww2abc.bwwtoabc()
+        #the warnings are shown by the process writing the book
+        worker_converter.diagnostics = bww2abc.Diagnostics("collect")
+    converter = worker_converter
+    converter.stats = None
+    if with_stats:
+        converter.enable_stats()
+    try:
+        converter.set_file(input_file, None)
+        converter.parse()
+        abc = bww2abc.render_elements(converter.tune_elements)
+        converter.lap("abc_text")
+    except bww2abc.ConversionError as e:
+        return (None, [], list(converter.diagnostics.events), converter.stats, str(e))
+    except Exception as e:
+        return (None, [], list(converter.diagnostics.events), converter.stats,
+            "%s: %s" % (e.__class__.__name__, e))
+    return (abc, list(converter.tune_title), list(converter.diagnostics.events),
+        converter.stats, None)
+
+def renumber(abc, first):
+    #abc, bytes with tunes numbered from 1, numbered from first instead.
+    #returns the new abc and the offset of each tune in it
+    abc = regex_tune_start.sub(
+        lambda match: b"X:%d" % (int(match.group(1)) - 1 + first), abc)
+    return (abc, [match.start() for match in regex_tune_start.finditer(abc)])
+
+def write_book(input_files, book_path, jobs=None, stats=None, diagnostics=None):
+    #convert input_files into the abc book book_path, in that order, with
+    #jobs processes, writing the index next to it. shows the warnings of
+    #each file like diagnostics, a bww2abc.Diagnostics.
+    #returns [(input file, error message)] for the files that failed
+    start = time.perf_counter()
+    if diagnostics is None:
+        diagnostics = bww2abc.Diagnostics(show_names=len(input_files) > 1)
+    book = bww2abc.OutputWriter(book_path)
+    index = bww2abc.OutputWriter(index_path(book_path), newline="")
+    failed = []
+    try:
+        header = ("% Book: " + os.path.basename(book_path) + "\n" +
+            bww2abc.bwwtoabc().get_abc_directives()).encode("utf-8")
+        book.write_bytes(header)
+        offset = len(header)
+        number = 1
+        items = [(input_file, stats is not None) for input_file in input_files]
+        results = bww2abc_split.map_tunes(items, jobs, convert_book_file)
+        for (input_file, (abc, titles, events, file_stats, error)) in zip(input_files, results):
+            name = os.path.basename(input_file)
+            if file_stats is not None:
+                stats.merge(file_stats)
+            diagnostics.replay(events, name=name)
+            diagnostics.finish(name)
+            if error:
+                failed.append((input_file, error))
+                continue
+            (abc, starts) = renumber(abc.encode("utf-8"), number)
+            part = ("\n% File: " + name + "\n").encode("utf-8")
+            book.write_bytes(part)
+            book.write_bytes(abc)
+            ends = starts[1:] + [len(abc)]
+            for (tune, (tune_start, tune_end)) in enumerate(zip(starts, ends)):
+                index.write(json.dumps({
+                    "number": number + tune,
+                    "title": titles[tune] if tune < len(titles) else "",
+                    "file": input_file,
+                    "offset": offset + len(part) + tune_start,
+                    "length": len(abc[tune_start:tune_end].rstrip()),
+                    }, sort_keys=True) + "\n")
+            number += len(starts)
+            offset += len(part) + len(abc)
+    except BaseException:
+        index.abort()
+        book.abort()
+        raise
+    book.commit()
+    index.commit()
+    if stats is not None:
+        stats.wall_time += time.perf_counter() - start
+    return failed
+
+def read_index(book_path):
+    #the index entries of the book at book_path, in the order of the book
+    file_handle = open(index_path(book_path), encoding="utf-8")
+    try:
+        return [json.loads(line) for line in file_handle if line.strip()]
+    finally:
+        file_handle.close()
+
+def read_tune(book_path, entry):
+    #the abc of the tune of an index entry, read without scanning the book
+    file_handle = open(book_path, "rb")
+    try:
+        with mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ) as book:
+            return book[entry["offset"]:entry["offset"] + entry["length"]].decode("utf-8")
+    finally:
+        file_handle.close()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+#
+#bww2abc_cache: a directory of finished conversions, keyed by a hash of the
+#bww file, so the unchanged files of a large collection aren't converted
+#again.
+#copyright: 2018
+#GPL v3
+#
+#An entry is <key>.abc, plus <key>.txt holding the converter's messages
+#when it printed any, in a subdirectory named after the first two
+#characters of the key. An entry's mtime is when it was last used, and
+#trim() removes the least recently used entries when the cache is too big.
+
+import os, io, sys, time, hashlib, contextlib
+import bww2abc
+
+#the default size cap in bytes
+default_max_size = 512 * 1024 * 1024
+
+#temporary files older than this are left over from a crash
+stale_age = 60 * 60
+
+class ConversionCache(object):
+    def __init__(self, directory, max_size=None):
+            self.directory = directory
+            self.max_size = default_max_size if max_size is None else max_size
+
+    def key(self, bww_bytes, name, settings=""):
+            #the output depends on the converter version and on the file
+            #name, which goes in the "% File:" line and a missing title.
+            #the messages depend on settings, Diagnostics.settings()
+            digest = hashlib.sha256()
+            digest.update(bww2abc.version.encode("utf-8") + b"\0")
+            digest.update(name.encode("utf-8") + b"\0")
+            if settings:
+                digest.update(settings.encode("utf-8") + b"\0")
+            digest.update(bww_bytes)
+            return digest.hexdigest()
+
+    def entry_path(self, key, extension):
+            return os.path.join(self.directory, key[:2], key + extension)
+
+    def get(self, key):
+            #returns (abc text, messages), or None if key isn't cached
+            path = self.entry_path(key, ".abc")
+            try:
+                abc = read_text(path)
+            except OSError:
+                return None
+            try:
+                messages = read_text(self.entry_path(key, ".txt"))
+            except OSError:
+                messages = ""
+            #mark the entry as recently used
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return (abc, messages)
+
+    def put(self, key, abc, messages):
+            #the .abc goes last, as once it is there the entry is complete
+            if messages:
+                write_entry(self.entry_path(key, ".txt"), messages)
+            write_entry(self.entry_path(key, ".abc"), abc)
+
+    def trim(self):
+            #remove the least recently used entries until the cache fits
+            entries = {}
+            total = 0
+            now = time.time()
+            try:
+                directories = [entry.path for entry in os.scandir(self.directory)
+                    if entry.is_dir()]
+            except OSError:
+                return
+            for directory in directories:
+                for entry in os.scandir(directory):
+                    (key, extension) = os.path.splitext(entry.name)
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if extension not in (".abc", ".txt"):
+                        if extension == ".tmp" and now - stat.st_mtime > stale_age:
+                            remove(entry.path)
+                        continue
+                    (used, size, paths) = entries.get(key, (0, 0, []))
+                    if extension == ".abc":
+                        used = stat.st_mtime
+                    entries[key] = (used, size + stat.st_size, paths + [entry.path])
+                    total += stat.st_size
+            if total <= self.max_size:
+                return
+            for (used, size, paths) in sorted(entries.values()):
+                for path in paths:
+                    remove(path)
+                total -= size
+                if total <= self.max_size:
+                    break
+
+def read_text(path):
+    file_handle = open(path, "r", encoding="utf-8", newline="")
+    try:
+        return file_handle.read()
+    finally:
+        file_handle.close()
+
+def write_entry(path, text):
+    #through a temporary file so other processes never read half an entry
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with bww2abc.OutputWriter(path, newline="") as writer:
+        writer.write(text)
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def write_if_changed(path, text):
+    #leave an output that is already right alone, so its mtime doesn't
+    #change and make-style tools don't rebuild from it
+    writer = bww2abc.OutputWriter(path, only_changed=True)
+    try:
+        writer.write(text)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit()
+
+def convert_cached(converter, cache, stream=False):
+    #convert the file converter.set_file() chose, using the cache.
+    #returns the output file like create_output_file()
+    file_handle = open(converter.original_file, "rb")
+    key = cache.key(file_handle.read(), converter.input_file_name,
+        converter.diagnostics.settings())
+    file_handle.close()
+    output_file = converter.output_path()
+
+    entry = cache.get(key)
+    if entry is not None:
+        converter.start_laps()
+        (abc, messages) = entry
+        sys.stdout.write(messages)
+        write_if_changed(output_file, abc)
+        converter.lap("cache")
+        if converter.stats is not None:
+            converter.stats.cache_hits += 1
+        return output_file
+
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(messages):
+            if stream:
+                #the abc as it is cached, before any newline translation
+                buffer = io.StringIO()
+                converter.stream_output_file(output_handle=buffer)
+                abc = buffer.getvalue()
+            else:
+                converter.parse()
+                abc = converter.get_abc_text()
+    finally:
+        sys.stdout.write(messages.getvalue())
+    write_if_changed(output_file, abc)
+    try:
+        cache.put(key, abc, messages.getvalue())
+    except OSError as e:
+        bww2abc.do_print("bww2abc: could not cache " + output_file + ": " + str(e))
+    return output_file
@@ -0,0 +1,579 @@
+#!/usr/bin/env python
+#
+#bww2abc_embellishments: the abc for every embellishment bww2abc knows,
+#made from the converter's rules so converting one is a dictionary lookup.
+#copyright: 2018
+#GPL v3
+#
+#Everything after the GENERATED line is made from the rules by
+#  python bww2abc_embellishments.py --write
+#Run it without --write to check the tables still match the rules, and
+#with --unsupported to list the tokens the embellishment patterns take but
+#the rules have no abc for. Converting one of those fails as it always has.
+
+import sys
+
+#the bww note names, as embellishments write them
+NOTE_PARTS = ("lg", "la", "b", "c", "d", "e", "f", "hg", "ha")
+
+#the element categories that are embellishments
+CATEGORIES = ("grace", "doublegrace", "doubling", "half_doubling",
+    "thumb_doubling", "single_strike", "strike", "grip", "pele", "echo",
+    "dict_embellishment")
+
+GENERATED = "#--- generated by python bww2abc_embellishments.py --write, do not edit ---\n"
+END = "#--- end of generated tables ---\n"
+
+def candidate_tokens(converter):
+    #every token the embellishment patterns are written for
+    tokens = [letter + "g" for letter in "abcdefgt"]
+    tokens += [first + note for first in "defgt" for note in NOTE_PARTS]
+    for style in ("db", "hdb", "tdb", "str", "echo"):
+        tokens += [style + note for note in NOTE_PARTS]
+    for light in ("", "l"):
+        for kind in ("", "g", "t", "h"):
+            for count in ("", "2", "3"):
+                tokens += [light + kind + "st" + count + note for note in NOTE_PARTS]
+    tokens += [style + note for style in ("grp", "ggrp", "tgrp", "hgrp") for note in ("",) + NOTE_PARTS]
+    for light in ("", "l"):
+        for style in ("", "t", "h"):
+            tokens += [light + style + "pel" + note for note in ("",) + NOTE_PARTS]
+    tokens += sorted(element for (element, text) in converter.transpose_dict.items()
+        if text.startswith("{"))
+    return tokens
+
+def build(converter):
+    #returns (the abc of each embellishment, the unsupported tokens) from
+    #the converter's rules
+    table = {}
+    unsupported = set()
+    for token in candidate_tokens(converter):
+        if token in table or token in unsupported:
+            continue
+        if converter.classify(token)[0] not in CATEGORIES:
+            continue
+        try:
+            action = converter.resolve_by_rules(token)
+        except (KeyError, TypeError):
+            unsupported.add(token)
+            continue
+        if action[0] == "append":
+            table[token] = action[1]
+    return (table, unsupported)
+
+def compare(table, unsupported):
+    #the differences between the tables in this module and table and
+    #unsupported, as messages
+    problems = []
+    for token in sorted(set(table) | set(EMBELLISHMENTS)):
+        if table.get(token) != EMBELLISHMENTS.get(token):
+            problems.append("%s: the table has %r, the rules make %r" %
+                (token, EMBELLISHMENTS.get(token), table.get(token)))
+    for token in sorted(unsupported ^ UNSUPPORTED):
+        problems.append("%s: %s" % (token, "unsupported by the rules" if token in unsupported
+            else "listed as unsupported but the rules don't fail"))
+    return problems
+
+def quote(text):
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def generate(table, unsupported):
+    lines = ["EMBELLISHMENTS = {"]
+    lines += ["    %s: %s," % (quote(token), quote(table[token])) for token in sorted(table)]
+    lines += ["    }", "", "UNSUPPORTED = frozenset(("]
+    tokens = [quote(token) + "," for token in sorted(unsupported)]
+    while tokens:
+        line = "   "
+        while tokens and len(line) + len(tokens[0]) < 78:
+            line += " " + tokens.pop(0)
+        lines.append(line)
+    lines += ["    ))", ""]
+    return "\n".join(lines)
+
+def write(table, unsupported):
+    path = __file__
+    file_handle = open(path, "r")
+    source = file_handle.read()
+    file_handle.close()
+    source = source[:source.index(GENERATED) + len(GENERATED)] + \
+        generate(table, unsupported) + source[source.rindex(END):]
+    file_handle = open(path, "w")
+    file_handle.write(source)
+    file_handle.close()
+
+def main(argv):
+    import bww2abc
+    (table, unsupported) = build(bww2abc.bwwtoabc())
+    if "--write" in argv:
+        write(table, unsupported)
+        print("%d embellishments, %d unsupported" % (len(table), len(unsupported)))
+        return 0
+    if "--unsupported" in argv:
+        for token in sorted(unsupported):
+            print(token)
+        return 0
+    problems = compare(table, unsupported)
+    for problem in problems:
+        print(problem)
+    if problems:
+        print("the tables don't match the rules, regenerate them with --write")
+        return 1
+    print("%d embellishments, %d unsupported: the tables match the rules" %
+        (len(table), len(unsupported)))
+    return 0
+
+#--- generated by python bww2abc_embellishments.py --write, do not edit ---
+EMBELLISHMENTS = {
+    "abr": "{AGAG}",
+    "ag": "{a}",
+    "bg": "{B}",
+    "brl": "{GAG}",
+    "bubly": "{GdGcG}",
+    "cadae": "{ae4}",
+    "cadaed": "{ae4d}",
+    "cadaf": "{af4}",
+    "cade": "{e4}",
+    "caded": "{e4d}",
+    "cadge": "{ge4}",
+    "cadged": "{ge4d}",
+    "cadgf": "{gf4}",
+    "cg": "{c}",
+    "chedare": "{fege}",
+    "chedari": "{fegefe}",
+    "crunl": "{GdGeAfA}",
+    "crunlb": "{GBGeAfA}",
+    "dare": "{fege}",
+    "darodo": "{GdGcG}",
+    "darodo16": "{G2dGcG2}",
+    "db": "{dB}",
+    "dbb": "{gBd}",
+    "dbc": "{gcd}",
+    "dbd": "{gde}",
+    "dbe": "{gef}",
+    "dbf": "{gfg}",
+    "dbha": "{ag}",
+    "dbhg": "{gf}",
+    "dbla": "{gAd}",
+    "dblg": "{gGd}",
+    "dbstf": "{fgf}",
+    "dbsthg": "{gag}",
+    "dc": "{dc}",
+    "dd": "{dd}",
+    "de": "{de}",
+    "deda": "{GdG}",
+    "df": "{df}",
+    "dg": "{d}",
+    "dha": "{da}",
+    "dhg": "{dg}",
+    "dili": "{ag}",
+    "din": "{G}",
+    "dla": "{dA}",
+    "dlg": "{dG}",
+    "dre": "{AfA}",
+    "eb": "{eB}",
+    "ec": "{ec}",
+    "echob": "{B}",
+    "echoc": "{c}",
+    "echod": "{d}",
+    "echoe": "{e}",
+    "echof": "{f}",
+    "echoha": "{a}",
+    "echohg": "{g}",
+    "echola": "{A}",
+    "echolg": "{G}",
+    "ed": "{ed}",
+    "edre": "{eAfA}",
+    "edreb": "{eBfB}",
+    "edrec": "{ecfc}",
+    "edred": "{edfd}",
+    "edrela": "{eAfA}",
+    "ee": "{ee}",
+    "ef": "{ef}",
+    "eg": "{e}",
+    "eha": "{ea}",
+    "ehg": "{eg}",
+    "ela": "{eA}",
+    "elg": "{eG}",
+    "embari": "{eAfA}",
+    "endari": "{eAfA}",
+    "fb": "{fB}",
+    "fc": "{fc}",
+    "fcadae": "{aHe4}",
+    "fcadaed": "{aHe4d}",
+    "fcadaf": "{aHf4}",
+    "fcade": "{He4}",
+    "fcaded": "{He4d}",
+    "fcadge": "{gHe4}",
+    "fcadged": "{gHe4d}",
+    "fcadgf": "{gHf4}",
+    "fd": "{fd}",
+    "fe": "{fe}",
+    "ff": "{ff}",
+    "fg": "{f}",
+    "fha": "{fa}",
+    "fhg": "{fg}",
+    "fla": "{fA}",
+    "flg": "{fG}",
+    "gb": "{gB}",
+    "gbr": "{gAGAG}",
+    "gc": "{gc}",
+    "gd": "{gd}",
+    "gdare": "{gfege}",
+    "ge": "{ge}",
+    "gedre": "{geAfA}",
+    "gf": "{gf}",
+    "gg": "{g}",
+    "ggrp": "{gGdG}",
+    "ggrpb": "{gBGdG}",
+    "ggrpc": "{gcGdG}",
+    "ggrpd": "{gdGdG}",
+    "ggrpe": "{geGdG}",
+    "ggrpf": "{gfGfG}",
+    "ggrpha": "{gaGdG}",
+    "ggrphg": "{ggGdG}",
+    "ggrpla": "{gAGdG}",
+    "ggrplg": "{gGGdG}",
+    "gha": "{ga}",
+    "ghg": "{gg}",
+    "gla": "{gA}",
+    "glg": "{gG}",
+    "godro": "{gcGdG}",
+    "gotro": "{gBGdG}",
+    "grp": "{GdG}",
+    "grpb": "{GBG}",
+    "grpc": "{cGdG}",
+    "grpd": "{dGdG}",
+    "grpe": "{eGdG}",
+    "grpf": "{fGdG}",
+    "grpha": "{aGdG}",
+    "grphg": "{gGdG}",
+    "grpla": "{AGdG}",
+    "grplg": "{GGdG}",
+    "gst2b": "{gBGBG}",
+    "gst2c": "{gcGcG}",
+    "gst2d": "{gdGdG}",
+    "gst2e": "{geAeA}",
+    "gst2f": "{gfefe}",
+    "gst2ha": "{gagag}",
+    "gst2hg": "{ggfgf}",
+    "gst2la": "{gAGAG}",
+    "gst3b": "{gBGBGBG}",
+    "gst3c": "{gcGcGcG}",
+    "gst3d": "{gdGdGdG}",
+    "gst3e": "{geAeAeA}",
+    "gst3f": "{gfefefe}",
+    "gst3ha": "{gagagag}",
+    "gst3hg": "{ggfgfgf}",
+    "gst3la": "{gAGAGAG}",
+    "gstb": "{gBG}",
+    "gstc": "{gcG}",
+    "gstd": "{gdG}",
+    "gste": "{geA}",
+    "gstf": "{gfe}",
+    "gstha": "{gag}",
+    "gsthg": "{ggf}",
+    "gstla": "{gAG}",
+    "hbubly": "{dGcG}",
+    "hchechere": "{eae}",
+    "hcrunlla": "{dAeAfA}",
+    "hcrunllgla": "{dGeAfA}",
+    "hdarodo": "{dGcG}",
+    "hdbb": "{Bd}",
+    "hdbc": "{cd}",
+    "hdbd": "{de}",
+    "hdbe": "{ef}",
+    "hdbf": "{fg}",
+    "hdbla": "{Ad}",
+    "hdblg": "{Gd}",
+    "hedale": "{ege}",
+    "hedari": "{egefe}",
+    "hgrp": "{dG}",
+    "hgrpb": "{BGdG}",
+    "hgrpc": "{cGdG}",
+    "hgrpd": "{dGdG}",
+    "hgrpe": "{eGdG}",
+    "hgrpf": "{fGfG}",
+    "hgrpha": "{aGdG}",
+    "hgrphg": "{gGdG}",
+    "hgrpla": "{AGdG}",
+    "hgrplg": "{GGdG}",
+    "hhvthrd": "{dGc}",
+    "hiharin": "{dAGAG}",
+    "hpelb": "{BeBG}",
+    "hpelc": "{cecG}",
+    "hpeld": "{dedG}",
+    "hpele": "{efeA}",
+    "hpelf": "{fgfe}",
+    "hpelhg": "{gagf}",
+    "hpella": "{AeAG}",
+    "hst2b": "{BGBG}",
+    "hst2c": "{cGcG}",
+    "hst2d": "{dGdG}",
+    "hst2e": "{eAeA}",
+    "hst2f": "{fefe}",
+    "hst2ha": "{agag}",
+    "hst2hg": "{gfgf}",
+    "hst2la": "{AGAG}",
+    "hst3b": "{BGBGBG}",
+    "hst3c": "{cGcGcG}",
+    "hst3d": "{dGdGdG}",
+    "hst3e": "{eAeAeA}",
+    "hst3f": "{fefefe}",
+    "hst3ha": "{agagag}",
+    "hst3hg": "{gfgfgf}",
+    "hst3la": "{AGAGAG}",
+    "hstb": "{BG}",
+    "hstc": "{cG}",
+    "hstd": "{dG}",
+    "hste": "{eA}",
+    "hstf": "{fe}",
+    "hstha": "{ag}",
+    "hsthg": "{gf}",
+    "hstla": "{AG}",
+    "htar": "{dGe}",
+    "htarla": "{dGe}",
+    "htarlg": "{dGe}",
+    "hthrd": "{dc}",
+    "htra": "{dc}",
+    "hvthrd": "{GdGc}",
+    "lgst2b": "{gdcdc}",
+    "lgst2c": "{gdcdc}",
+    "lgst2d": "{gdcdc}",
+    "lgst2e": "{gdcdc}",
+    "lgst2f": "{gdcdc}",
+    "lgst2ha": "{gdcdc}",
+    "lgst2hg": "{gdcdc}",
+    "lgst2la": "{gdcdc}",
+    "lgst3b": "{gdcdcdc}",
+    "lgst3c": "{gdcdcdc}",
+    "lgst3d": "{gdcdcdc}",
+    "lgst3e": "{gdcdcdc}",
+    "lgst3f": "{gdcdcdc}",
+    "lgst3ha": "{gdcdcdc}",
+    "lgst3hg": "{gdcdcdc}",
+    "lgst3la": "{gdcdcdc}",
+    "lgstb": "{gdc}",
+    "lgstc": "{gdc}",
+    "lgstd": "{gdc}",
+    "lgste": "{gdc}",
+    "lgstf": "{gdc}",
+    "lgstha": "{gdc}",
+    "lgsthg": "{gdc}",
+    "lgstla": "{gdc}",
+    "lhpelb": "{dedc}",
+    "lhpelc": "{dedc}",
+    "lhpeld": "{dedc}",
+    "lhpele": "{dedc}",
+    "lhpelf": "{dedc}",
+    "lhpelhg": "{dedc}",
+    "lhpella": "{dedc}",
+    "lhst2b": "{dcdc}",
+    "lhst2c": "{dcdc}",
+    "lhst2d": "{dcdc}",
+    "lhst2e": "{dcdc}",
+    "lhst2f": "{dcdc}",
+    "lhst2ha": "{dcdc}",
+    "lhst2hg": "{dcdc}",
+    "lhst2la": "{dcdc}",
+    "lhst3b": "{dcdcdc}",
+    "lhst3c": "{dcdcdc}",
+    "lhst3d": "{dcdcdc}",
+    "lhst3e": "{dcdcdc}",
+    "lhst3f": "{dcdcdc}",
+    "lhst3ha": "{dcdcdc}",
+    "lhst3hg": "{dcdcdc}",
+    "lhst3la": "{dcdcdc}",
+    "lhstb": "{dc}",
+    "lhstc": "{dc}",
+    "lhstd": "{dc}",
+    "lhste": "{dc}",
+    "lhstf": "{dc}",
+    "lhstha": "{dc}",
+    "lhsthg": "{dc}",
+    "lhstla": "{dc}",
+    "lpelb": "{gdedc}",
+    "lpelc": "{gdedc}",
+    "lpeld": "{gdedc}",
+    "lpele": "{gdedc}",
+    "lpelf": "{gdedc}",
+    "lpella": "{gdedc}",
+    "lst2b": "{cdc}",
+    "lst2c": "{cdc}",
+    "lst2d": "{cdc}",
+    "lst2e": "{cdc}",
+    "lst2f": "{cdc}",
+    "lst2ha": "{cdc}",
+    "lst2hg": "{cdc}",
+    "lst2la": "{cdc}",
+    "lst3b": "{cdcdc}",
+    "lst3c": "{cdcdc}",
+    "lst3d": "{cdcdc}",
+    "lst3e": "{cdcdc}",
+    "lst3f": "{cdcdc}",
+    "lst3ha": "{cdcdc}",
+    "lst3hg": "{cdcdc}",
+    "lst3la": "{cdcdc}",
+    "lstb": "{c}",
+    "lstc": "{c}",
+    "lstd": "{c}",
+    "lste": "{c}",
+    "lstf": "{c}",
+    "lstha": "{c}",
+    "lsthg": "{c}",
+    "lstla": "{c}",
+    "ltpelb": "{adedc}",
+    "ltpelc": "{adedc}",
+    "ltpeld": "{adedc}",
+    "ltpele": "{adedc}",
+    "ltpelf": "{adedc}",
+    "ltpelhg": "{adedc}",
+    "ltpella": "{adedc}",
+    "ltst2b": "{adcdc}",
+    "ltst2c": "{adcdc}",
+    "ltst2d": "{adcdc}",
+    "ltst2e": "{adcdc}",
+    "ltst2f": "{adcdc}",
+    "ltst2ha": "{adcdc}",
+    "ltst2hg": "{adcdc}",
+    "ltst2la": "{adcdc}",
+    "ltst3b": "{adcdcdc}",
+    "ltst3c": "{adcdcdc}",
+    "ltst3d": "{adcdcdc}",
+    "ltst3e": "{adcdcdc}",
+    "ltst3f": "{adcdcdc}",
+    "ltst3ha": "{adcdcdc}",
+    "ltst3hg": "{adcdcdc}",
+    "ltst3la": "{adcdcdc}",
+    "ltstb": "{adc}",
+    "ltstc": "{adc}",
+    "ltstd": "{adc}",
+    "ltste": "{adc}",
+    "ltstf": "{adc}",
+    "ltstha": "{adc}",
+    "ltsthg": "{adc}",
+    "ltstla": "{adc}",
+    "odro": "{cGdG}",
+    "otro": "{BGdG}",
+    "pelb": "{gBeBG}",
+    "pelc": "{gcecG}",
+    "peld": "{gdedG}",
+    "pele": "{gefeA}",
+    "pelf": "{gfgfe}",
+    "pella": "{gAeAG}",
+    "rodin": "{GBG}",
+    "st2b": "{GBG}",
+    "st2c": "{GcG}",
+    "st2d": "{GdG}",
+    "st2e": "{AeA}",
+    "st2f": "{efe}",
+    "st2ha": "{gag}",
+    "st2hg": "{fgf}",
+    "st2la": "{GAG}",
+    "st3b": "{GBGBG}",
+    "st3c": "{GcGcG}",
+    "st3d": "{GdGdG}",
+    "st3e": "{AeAeA}",
+    "st3f": "{efefe}",
+    "st3ha": "{gagag}",
+    "st3hg": "{fgfgf}",
+    "st3la": "{GAGAG}",
+    "stb": "{BG}",
+    "stc": "{cG}",
+    "std": "{dG}",
+    "ste": "{eA}",
+    "stf": "{fe}",
+    "stha": "{ag}",
+    "sthg": "{gf}",
+    "stla": "{AG}",
+    "strb": "{B}",
+    "strc": "{c}",
+    "strd": "{d}",
+    "stre": "{e}",
+    "strf": "{f}",
+    "strhg": "{g}",
+    "strla": "{A}",
+    "strlg": "{G}",
+    "tar": "{GdGe}",
+    "tarb": "{GBGe}",
+    "tarbrea": "{GdGe}",
+    "tb": "{aB}",
+    "tbr": "{aAGAG}",
+    "tbrl": "{aGAG}",
+    "tc": "{ac}",
+    "tchechere": "{ageae}",
+    "td": "{ad}",
+    "tdare": "{afege}",
+    "tdbb": "{aBd}",
+    "tdbc": "{acd}",
+    "tdbd": "{ade}",
+    "tdbe": "{aef}",
+    "tdbf": "{afg}",
+    "tdbla": "{aAd}",
+    "tdblg": "{aGd}",
+    "te": "{ae}",
+    "tedre": "{aeAfA}",
+    "tf": "{af}",
+    "tg": "{a}",
+    "tgrp": "{aGdG}",
+    "tgrpb": "{aBGdG}",
+    "tgrpc": "{acGdG}",
+    "tgrpd": "{adGdG}",
+    "tgrpe": "{aeGdG}",
+    "tgrpf": "{afGfG}",
+    "tgrpha": "{aaGdG}",
+    "tgrphg": "{agGfG}",
+    "tgrpla": "{aAGdG}",
+    "tgrplg": "{aGGdG}",
+    "tha": "{aa}",
+    "thg": "{ag}",
+    "thrd": "{Gdc}",
+    "tla": "{aA}",
+    "tlg": "{aG}",
+    "tpelb": "{aBeBG}",
+    "tpelc": "{acecG}",
+    "tpeld": "{adedG}",
+    "tpele": "{aefeA}",
+    "tpelf": "{afgfe}",
+    "tpelhg": "{agagf}",
+    "tpella": "{aAeAG}",
+    "tra": "{G2dc}",
+    "tra8": "{G2dc}",
+    "tst2b": "{aBGBG}",
+    "tst2c": "{acGcG}",
+    "tst2d": "{adGdG}",
+    "tst2e": "{aeAeA}",
+    "tst2f": "{afefe}",
+    "tst2ha": "{aagag}",
+    "tst2hg": "{agfgf}",
+    "tst2la": "{aAGAG}",
+    "tst3b": "{aBGBGBG}",
+    "tst3c": "{acGcGcG}",
+    "tst3d": "{adGdGdG}",
+    "tst3e": "{aeAeAeA}",
+    "tst3f": "{afefefe}",
+    "tst3ha": "{aagagag}",
+    "tst3hg": "{agfgfgf}",
+    "tst3la": "{aAGAGAG}",
+    "tstb": "{aBG}",
+    "tstc": "{acG}",
+    "tstd": "{adG}",
+    "tste": "{aeA}",
+    "tstf": "{afe}",
+    "tstha": "{aag}",
+    "tsthg": "{agf}",
+    "tstla": "{aAG}",
+    }
+
+UNSUPPORTED = frozenset((
+    "gst2lg", "gst3lg", "gstlg", "hdbha", "hdbhg", "hpel", "hpelha", "hpellg",
+    "hst2lg", "hst3lg", "hstlg", "lgst2lg", "lgst3lg", "lgstlg", "lhpel",
+    "lhpelha", "lhpellg", "lhst2lg", "lhst3lg", "lhstlg", "lpel", "lpelha",
+    "lpelhg", "lpellg", "lst2lg", "lst3lg", "lstlg", "ltpel", "ltpelha",
+    "ltpellg", "ltst2lg", "ltst3lg", "ltstlg", "pel", "pelha", "pelhg",
+    "pellg", "st2lg", "st3lg", "stlg", "strha", "tdbha", "tdbhg", "tpel",
+    "tpelha", "tpellg", "tst2lg", "tst3lg", "tstlg",
+    ))
+#--- end of generated tables ---
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+#
+#bww2abc_ir: a compact form of a parsed tune. The bww is read once into a
+#stream of typed events, which can be saved, mapped back in from disk and
+#rendered to abc, indexed or analysed without reading the bww again.
+#copyright: 2018
+#GPL v3
+#
+#The events live in parallel array columns:
+#  op       the opcode, an index into OPCODES
+#  flags    NOTE_ZERO_VALUE and NOTE_COUNTED for notes
+#  a, b, c  the opcode's parameters, mostly indices into the string table
+#    note                 a pitch, b length, c direction
+#    grace, bar, repeat, accidental, mark, mark_previous, tie, tempo, unparsed
+#                         a text
+#    slur                 a note count, b start or end
+#    time_sig             a bww time signature, b abc time signature
+#    comment, header      a comment or header number
+#    dot, doubledot, fermat  nothing
+#
+#The file layout, little endian:
+#  header          magic, format version, event, string and metadata sizes
+#  op, flags       a byte per event each, padded to 4 bytes
+#  a, b, c         a 4 byte integer per event each
+#  string offsets  string count + 1 4 byte integers into the string data
+#  string data     utf-8
+#  metadata        utf-8 json: file name, titles, comments and time signature
+
+import sys, os, json, struct, mmap, fractions
+from array import array
+import bww2abc
+
+FORMAT_VERSION = 1
+MAGIC = b"BWWIR\0"
+HEADER = struct.Struct("<6sHIII")
+
+OPCODES = ("note", "grace", "bar", "repeat", "accidental", "mark", "dot",
+    "doubledot", "slur", "tie", "comment", "header", "tempo", "time_sig",
+    "fermat", "mark_previous", "unparsed")
+OPCODE = dict((name, number) for (number, name) in enumerate(OPCODES))
+
+#opcodes that just add their text to the tune
+TEXT_OPCODES = frozenset(("grace", "bar", "repeat", "accidental", "mark"))
+
+#element categories whose text is a grace note group
+GRACE_CATEGORIES = frozenset(("grace", "doublegrace", "doubling",
+    "half_doubling", "thumb_doubling", "single_strike", "strike", "grip",
+    "pele", "echo"))
+#the other categories that add text, by opcode
+TEXT_CATEGORIES = {
+    "sub_repeat": "repeat",
+    "sharp": "accidental",
+    "natural": "accidental",
+    "flat": "accidental",
+    "next_note_mark": "mark",
+    }
+
+NOTE_ZERO_VALUE = 1
+NOTE_COUNTED = 2
+
+#the converter state lex_text() leaves for rendering
+METADATA = ("input_file_name", "comments_list", "tune_title", "tune_type",
+    "tune_author", "tune_footer", "tune_time_sig", "unparsed_time_sig")
+
+class TuneIR(object):
+    def __init__(self):
+            self.op = array("B")
+            self.flags = array("B")
+            self.a = array("i")
+            self.b = array("i")
+            self.c = array("i")
+            self.strings = []
+            self.string_ids = {}
+            self.metadata = {}
+            #set when the columns are views of a mapped file
+            self.mapping = None
+            self.views = []
+
+    def __len__(self):
+            return len(self.op)
+
+    def string_id(self, text):
+            number = self.string_ids.get(text)
+            if number is None:
+                number = self.string_ids[text] = len(self.strings)
+                self.strings.append(text)
+            return number
+
+    def add(self, op, flags=0, a=0, b=0, c=0):
+            self.op.append(op)
+            self.flags.append(flags)
+            self.a.append(a)
+            self.b.append(b)
+            self.c.append(c)
+
+    def encode(self, category, action):
+            #turn a converter action into an event, or None if it does nothing
+            name = action[0]
+            if name == "ignore":
+                return None
+            if name == "append":
+                opcode = TEXT_CATEGORIES.get(category)
+                if opcode is None:
+                    if category in GRACE_CATEGORIES or action[1].startswith("{"):
+                        opcode = "grace"
+                    else:
+                        #bar lines, part starts and ends and the like
+                        opcode = "bar"
+                return (OPCODE[opcode], 0, self.string_id(action[1]), 0, 0)
+            if name == "note":
+                (pitch, duration, length, direction, zero_value, counted) = action[1:]
+                flags = (zero_value and NOTE_ZERO_VALUE) | (counted and NOTE_COUNTED)
+                return (OPCODE["note"], flags, self.string_id(pitch),
+                    self.string_id(length), self.string_id(direction))
+            if name in ("comment", "header"):
+                return (OPCODE[name], 0, action[1], 0, 0)
+            #the rest only have text parameters
+            ids = [self.string_id(text) for text in action[1:]] + [0, 0]
+            return (OPCODE[name], 0, ids[0], ids[1], 0)
+
+    def decode(self, op, flags, a, b, c):
+            #turn an event back into a converter action
+            opcode = OPCODES[op]
+            strings = self.strings
+            if opcode in TEXT_OPCODES:
+                return ("append", strings[a])
+            if opcode == "note":
+                length = strings[b]
+                duration = fractions.Fraction(length) if length else None
+                return ("note", strings[a], duration, length, strings[c],
+                    bool(flags & NOTE_ZERO_VALUE), bool(flags & NOTE_COUNTED))
+            if opcode in ("comment", "header"):
+                return (opcode, a)
+            if opcode in ("slur", "time_sig"):
+                return (opcode, strings[a], strings[b])
+            if opcode in ("dot", "doubledot", "fermat"):
+                return (opcode,)
+            return (opcode, strings[a])
+
+    def events(self):
+            #yield (opcode, action) for each event
+            actions = {}
+            for event in zip(self.op, self.flags, self.a, self.b, self.c):
+                action = actions.get(event)
+                if action is None:
+                    action = actions[event] = self.decode(*event)
+                yield (OPCODES[event[0]], action)
+
+    def to_bytes(self):
+            strings = [text.encode("utf-8") for text in self.strings]
+            offsets = array("i", [0])
+            for text in strings:
+                offsets.append(offsets[-1] + len(text))
+            metadata = json.dumps(self.metadata).encode("utf-8")
+            count = len(self)
+            parts = [HEADER.pack(MAGIC, FORMAT_VERSION, count, len(strings), len(metadata)),
+                bytes(self.op), bytes(self.flags), b"\0" * padding(2 * count)]
+            for column in (self.a, self.b, self.c, offsets):
+                column = array("i", column)
+                if sys.byteorder == "big":
+                    column.byteswap()
+                parts.append(column.tobytes())
+            parts.extend(strings)
+            parts.append(metadata)
+            return b"".join(parts)
+
+    def close(self):
+            #let go of a mapped file
+            for view in reversed(self.views):
+                view.release()
+            self.views = []
+            if self.mapping is not None:
+                self.mapping.close()
+                self.mapping = None
+
+#the strings of a mapped file, decoded when they are first used
+class MappedStrings(object):
+    def __init__(self, offsets, data):
+            self.offsets = offsets
+            self.data = data
+            self.decoded = [None] * (len(offsets) - 1)
+
+    def __len__(self):
+            return len(self.decoded)
+
+    def __getitem__(self, number):
+            text = self.decoded[number]
+            if text is None:
+                text = self.decoded[number] = \
+                    bytes(self.data[self.offsets[number]:self.offsets[number+1]]).decode("utf-8")
+            return text
+
+def padding(size):
+    return -size % 4
+
+def parse_text(bww_text, name="untitled.bww", converter=None):
+    #read bww text, or bytes from bww2abc.read_bww(), into a TuneIR
+    converter = converter or bww2abc.bwwtoabc()
+    converter.reset()
+    converter.input_file_name = name
+    elements = converter.lex_text(bww_text)
+    ir = TuneIR()
+    events = {}
+    for element in elements:
+        if element in events:
+            event = events[element]
+        else:
+            (category, match) = converter.classify(element)
+            event = events[element] = ir.encode(category, converter.resolve_cached(element))
+        if event is not None:
+            ir.add(*event)
+    for attribute in METADATA:
+        ir.metadata[attribute] = getattr(converter, attribute)
+    return ir
+
+def parse_file(path, converter=None):
+    return parse_text(bww2abc.read_bww(path), os.path.basename(path), converter)
+
+def render(ir, converter=None):
+    #return the abc text for a TuneIR
+    converter = converter or bww2abc.bwwtoabc()
+    converter.reset()
+    for attribute in METADATA:
+        value = ir.metadata[attribute]
+        if isinstance(value, list):
+            value = list(value)
+        setattr(converter, attribute, value)
+    handlers = converter.action_handlers
+    with bww2abc.paused_gc():
+        for (opcode, action) in ir.events():
+            handlers[action[0]](*action[1:])
+    converter.finish_tune()
+    return converter.get_abc_text()
+
+def save(ir, path):
+    file_handle = open(path, "wb")
+    file_handle.write(ir.to_bytes())
+    file_handle.close()
+
+def load(path):
+    #map a saved TuneIR back in. its columns read straight from the file,
+    #so close() it when done.
+    file_handle = open(path, "rb")
+    try:
+        mapping = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        raise bww2abc.ConversionError(path + " is not a bww2abc IR file")
+    finally:
+        file_handle.close()
+    try:
+        ir = from_buffer(mapping, path)
+    except bww2abc.ConversionError:
+        mapping.close()
+        raise
+    ir.mapping = mapping
+    return ir
+
+def from_buffer(data, name="buffer"):
+    #make a TuneIR that reads its columns from data, without copying them
+    view = memoryview(data)
+    ir = TuneIR()
+    ir.views.append(view)
+    def fail(message):
+        ir.close()
+        raise bww2abc.ConversionError(name + ": " + message)
+    if len(view) < HEADER.size:
+        fail("not a bww2abc IR file")
+    (magic, version, count, string_count, metadata_size) = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        fail("not a bww2abc IR file")
+    if version != FORMAT_VERSION:
+        fail("IR format version %d, this is version %d" % (version, FORMAT_VERSION))
+    offset = HEADER.size + 2 * count + padding(2 * count)
+    strings_at = offset + 4 * (3 * count + string_count + 1)
+    if len(view) < strings_at:
+        fail("file is truncated")
+    def column(start, size, format):
+        part = view[start:start + size]
+        if format == "i" and (sys.byteorder == "big" or array("i").itemsize != 4):
+            values = array("i")
+            values.frombytes(part)
+            if sys.byteorder == "big":
+                values.byteswap()
+            return values
+        part = part.cast(format)
+        ir.views.append(part)
+        return part
+    ir.op = column(HEADER.size, count, "B")
+    ir.flags = column(HEADER.size + count, count, "B")
+    (ir.a, ir.b, ir.c) = [column(offset + 4 * count * number, 4 * count, "i")
+        for number in range(3)]
+    offsets = column(offset + 12 * count, 4 * (string_count + 1), "i")
+    metadata_at = strings_at + offsets[-1]
+    if len(view) < metadata_at + metadata_size:
+        fail("file is truncated")
+    strings = view[strings_at:metadata_at]
+    ir.views.append(strings)
+    ir.strings = MappedStrings(offsets, strings)
+    ir.string_ids = None
+    ir.metadata = json.loads(bytes(view[metadata_at:metadata_at + metadata_size]).decode("utf-8"))
+    return ir
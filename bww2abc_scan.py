@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+#bww2abc_scan: reads the tune headers, tempo and element counts of bww
+#files without converting them, into an sqlite catalog.
+#copyright: 2018
+#GPL v3
+#
+#A scan runs only the steps of a conversion before transpose(): cleaning
+#the text, get_and_strip_metadata() and splitting it into elements, which
+#are counted by category like --stats counts them. The catalog has a row
+#in files for every file and a row in tunes for every tune. A file whose
+#size and modification time haven't changed isn't read again, and one
+#whose contents hash the same isn't scanned again, so updating the catalog
+#of a large archive only does the work for the files that changed.
+#
+#  python bww2abc.py --scan tunes.db DIR ...
+#  sqlite3 tunes.db "select title, composer, path from tunes where type = 'Reel'"
+
+import os, json, time, hashlib, sqlite3, collections
+import bww2abc
+
+SCHEMA = """
+create table if not exists files (
+    path text primary key,
+    hash text not null,
+    size integer not null,
+    mtime real not null,
+    tunes integer not null,
+    tempo integer,
+    time_signature text,
+    elements integer not null,
+    categories text not null,
+    scanned real not null
+);
+create table if not exists tunes (
+    path text not null references files(path) on delete cascade,
+    number integer not null,
+    title text,
+    type text,
+    composer text,
+    footer text,
+    primary key (path, number)
+);
+create index if not exists tunes_title on tunes(title);
+"""
+
+def open_catalog(path):
+    catalog = sqlite3.connect(path)
+    catalog.execute("pragma foreign_keys = on")
+    catalog.executescript(SCHEMA)
+    return catalog
+
+def scan_data(data, name, converter):
+    #the metadata of bww bytes from read_bww(), as a dict
+    converter.reset()
+    converter.diagnostics.clear()
+    converter.input_file_name = name
+    text = converter.stripNonPrintableCharacters(data)
+    #a file without a title is one tune named after the file, as it
+    #converts to
+    text = converter.get_and_strip_metadata(text)
+    titles = converter.tune_title
+    elements = converter.split_elements(text)
+    stats = bww2abc.ConversionStats()
+    converter.stats = stats
+    converter.add_element_counts(collections.Counter(elements))
+    converter.stats = None
+    tempo = None
+    for element in elements:
+        (category, match) = converter.classify(element)
+        if category == "tempo":
+            tempo = int(match.group("tempo_value"))
+            break
+    tunes = []
+    for number in range(len(titles)):
+        tune = {"number": number + 1, "title": titles[number]}
+        for (key, values) in (("type", converter.tune_type),
+                ("composer", converter.tune_author), ("footer", converter.tune_footer)):
+            tune[key] = values[number] if number < len(values) else None
+        tunes.append(tune)
+    return {
+        "tunes": tunes,
+        "tempo": tempo,
+        "time_signature": converter.tune_time_sig,
+        "elements": stats.elements,
+        "categories": stats.categories,
+        }
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def update_catalog(catalog_path, input_files):
+    #scan the input_files that changed since the catalog last saw them and
+    #forget the files it has that are gone.
+    #returns (scanned, unchanged, removed, [(input file, error message)])
+    catalog = open_catalog(catalog_path)
+    converter = bww2abc.bwwtoabc()
+    converter.diagnostics = bww2abc.Diagnostics("quiet")
+    known = dict((path, (size, mtime, digest)) for (path, size, mtime, digest) in
+        catalog.execute("select path, size, mtime, hash from files"))
+    scanned = unchanged = 0
+    failed = []
+    try:
+        for input_file in input_files:
+            path = os.path.abspath(input_file)
+            try:
+                stat = os.stat(path)
+                entry = known.get(path)
+                if entry and entry[:2] == (stat.st_size, stat.st_mtime):
+                    unchanged += 1
+                    continue
+                data = bww2abc.read_bww(path)
+                digest = file_hash(data)
+                if entry and entry[2] == digest:
+                    catalog.execute("update files set size = ?, mtime = ? where path = ?",
+                        (stat.st_size, stat.st_mtime, path))
+                    unchanged += 1
+                    continue
+                info = scan_data(data, os.path.basename(path), converter)
+            except Exception as e:
+                failed.append((input_file, "%s: %s" % (e.__class__.__name__, e)))
+                continue
+            catalog.execute("delete from files where path = ?", (path,))
+            catalog.execute("insert into files values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, digest, stat.st_size, stat.st_mtime, len(info["tunes"]), info["tempo"],
+                info["time_signature"], info["elements"],
+                json.dumps(info["categories"], sort_keys=True), time.time()))
+            catalog.executemany("insert into tunes values (?, ?, ?, ?, ?, ?)",
+                [(path, tune["number"], tune["title"], tune["type"], tune["composer"],
+                    tune["footer"]) for tune in info["tunes"]])
+            scanned += 1
+        removed = [path for path in known if not os.path.isfile(path)]
+        catalog.executemany("delete from files where path = ?", [(path,) for path in removed])
+        catalog.commit()
+    finally:
+        catalog.close()
+    return (scanned, unchanged, len(removed), failed)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+#bww2abc_server: keeps warm bwwtoabc converters in a long running process
+#and converts tunes for other bww2abc commands over a local socket.
+#copyright: 2018
+#GPL v3
+#
+#The protocol is one JSON request per connection. The client sends the
+#request, shuts down its side of the socket and reads one JSON response.
+#  request:  {"version": ..., "text": BWW text or "path": BWW file, "name": file name}
+#  response: {"abc": ABC text, "messages": converter output, "error": message}
+#A response with "fatal" set means the client should convert the file
+#itself, which reports the problem the usual way.
+
+import os, sys, io, json, signal, socket, socketserver, threading, contextlib
+import bww2abc
+
+#the largest request the server will read
+max_request_size = 64 * 1024 * 1024
+
+#how long a request waits for a worker before the server turns it away
+busy_wait = 30
+
+#how long a client waits for the server to answer before it converts the
+#file itself. longer than busy_wait, plus a large conversion
+request_timeout = busy_wait + 90
+
+#the converter each worker process keeps warm
+worker_converter = None
+
+def start_worker():
+    global worker_converter
+    #the server process handles interrupts and shuts the workers down
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_converter = bww2abc.bwwtoabc()
+
+def convert_request(request):
+    #runs in a worker process. returns the response for one request.
+    response = {"version": bww2abc.version}
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(messages):
+            text = request.get("text")
+            if text is None:
+                text = bww2abc.read_bww(request["path"])
+            name = request.get("name") or os.path.basename(request.get("path", ""))
+            response["abc"] = worker_converter.convert(text, name)
+    except bww2abc.ConversionError as e:
+        response["error"] = str(e)
+    except Exception as e:
+        response["error"] = "%s: %s" % (e.__class__.__name__, e)
+        response["fatal"] = True
+    response["messages"] = messages.getvalue()
+    return response
+
+class ConversionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        data = self.rfile.read(max_request_size + 1)
+        if len(data) > max_request_size:
+            response = {"error": "request too large", "fatal": True}
+        else:
+            try:
+                request = json.loads(data.decode("utf-8"))
+                response = self.server.convert(request)
+            except ValueError as e:
+                response = {"error": "bad request: %s" % e, "fatal": True}
+        self.wfile.write(json.dumps(response).encode("utf-8"))
+
+class ConversionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, jobs=None, max_requests=None):
+        from concurrent.futures import ProcessPoolExecutor
+        jobs = jobs or os.cpu_count() or 1
+        #requests beyond this are turned away rather than queued forever
+        self.requests = threading.BoundedSemaphore(max_requests or 4 * jobs)
+        self.executor = ProcessPoolExecutor(max_workers=jobs, initializer=start_worker)
+        socketserver.UnixStreamServer.__init__(self, path, ConversionHandler)
+
+    def convert(self, request):
+        if request.get("version") != bww2abc.version:
+            return {"error": "server runs version " + bww2abc.version, "fatal": True}
+        if not self.requests.acquire(timeout=busy_wait):
+            return {"error": "server busy", "fatal": True}
+        try:
+            return self.executor.submit(convert_request, request).result()
+        finally:
+            self.requests.release()
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.executor.shutdown()
+
+def send_request(request, path, timeout=None):
+    #send one request to the server at path.
+    #returns the response, or None if no server answered within timeout.
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(timeout)
+        connection.connect(path)
+        connection.sendall(json.dumps(request).encode("utf-8"))
+        connection.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return json.loads(b"".join(chunks).decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+    finally:
+        connection.close()
+
+def convert_with_server(converter, path):
+    #convert the file converter.set_file() chose with the server at path and
+    #write the output where converter would have.
+    #returns (output file, error message), or None to convert locally.
+    response = send_request({
+        "version": bww2abc.version,
+        "path": os.path.abspath(converter.original_file),
+        "name": converter.input_file_name,
+        }, path, request_timeout)
+    if response is None or response.get("fatal"):
+        return None
+    sys.stdout.write(response.get("messages", ""))
+    if response.get("error") is not None:
+        return (None, response["error"])
+    return (converter.write_output_file(response["abc"]), None)
+
+def serve(path, jobs=None):
+    #run a conversion server on path until interrupted
+    if not hasattr(socket, "AF_UNIX"):
+        sys.exit("bww2abc: the server needs unix domain sockets")
+    if os.path.exists(path):
+        if send_request({}, path, timeout=1) is not None:
+            sys.exit("bww2abc: a server is already listening on " + path)
+        # left over from a server that didn't shut down cleanly
+        os.remove(path)
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, stop)
+    #only this user may connect, from the moment the socket is made
+    old_umask = os.umask(0o177)
+    try:
+        server = ConversionServer(path, jobs)
+    finally:
+        os.umask(old_umask)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
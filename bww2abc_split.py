@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+#bww2abc_split: converts the tunes of a multi-tune file, like a collection
+#book, in parallel and puts the abc back together in order.
+#copyright: 2018
+#GPL v3
+#
+#A file is split before the title of every tune after the first, keeping
+#the type, composer and footer quotes written just before a title with it.
+#Each tune is converted by a converter with fresh state, numbered by the
+#tunes before it so the X: fields run on across the file. So a tune
+#starts the way a file does: its M: field is its own first time signature
+#rather than the last one of the tune before, and its first note doesn't
+#put a space after the last note of the tune before. Tunes without notes
+#stay with the tune before them.
+
+import os
+import bww2abc
+
+#quote types that belong to the header of the title after them
+HEADER_TYPES = ("Y", "M", "F")
+
+#the converter each worker process reuses
+worker_converter = None
+
+def split_tunes(text, converter):
+    #split cleaned bww text into (text, tunes before it) pieces
+    quotes = list(converter.regex_quote.finditer(text))
+    starts = [0]
+    #the number of titles from each start
+    titles = [0]
+    for (number, quote) in enumerate(quotes):
+        if quote.group("type") != "T":
+            continue
+        if not titles[0]:
+            titles[0] = 1
+            continue
+        first = number
+        while first > 0 and quotes[first-1].group("type") in HEADER_TYPES and \
+                quotes[first-1].start() > starts[-1] and \
+                not text[quotes[first-1].end():quotes[first].start()].strip():
+            first -= 1
+        starts.append(quotes[first].start())
+        titles.append(1)
+    ends = starts[1:] + [len(text)]
+    pieces = []
+    offset = 0
+    for (start, end, count) in zip(starts, ends, titles):
+        piece = text[start:end]
+        if pieces and not has_notes(piece, converter):
+            pieces[-1][0] += piece
+        elif len(pieces) == 1 and not has_notes(pieces[0][0], converter):
+            pieces[0][0] += piece
+        else:
+            pieces.append([piece, offset])
+        offset += count
+    return [tuple(piece) for piece in pieces]
+
+def has_notes(text, converter):
+    #lex_text() wants an ampersand outside the quotes
+    return "&" in converter.regex_quote.sub("", text)
+
+def convert_tune(tune):
+    #runs in a worker process. tune is (bww text, file name, tunes before
+    #it, whether to keep stats). returns (abc text, warning events, number
+    #of elements, stats or None)
+    global worker_converter
+    (text, name, offset, with_stats) = tune
+    if worker_converter is None:
+        worker_converter = bww2abc.bwwtoabc()
+        #the warnings are shown by the process putting the tunes together
+        worker_converter.diagnostics = bww2abc.Diagnostics("collect")
+    converter = worker_converter
+    converter.reset()
+    converter.input_file_name = name
+    converter.tune_number_offset = offset
+    converter.stats = None
+    if with_stats:
+        converter.enable_stats()
+    converter.diagnostics.clear()
+    elements = converter.parse_text(text)
+    abc = bww2abc.render_elements(converter.tune_elements)
+    converter.lap("abc_text")
+    return (abc, converter.diagnostics.events, elements, converter.stats)
+
+def map_tunes(tunes, jobs=None, convert=convert_tune):
+    #yield the results of convert(), convert_tune() unless given, in order
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(tunes)))
+    if jobs == 1:
+        for tune in tunes:
+            yield convert(tune)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        chunk_size = max(1, len(tunes) // (jobs * 4))
+        for result in executor.map(convert, tunes, chunksize=chunk_size):
+            yield result
+
+def convert_split(input_file, output=None, jobs=None, stats=None, diagnostics=None):
+    #convert input_file a tune at a time with jobs processes, showing the
+    #warnings like diagnostics, a bww2abc.Diagnostics.
+    #returns the output file like create_output_file()
+    converter = bww2abc.bwwtoabc()
+    if stats is not None:
+        converter.enable_stats(stats)
+    if diagnostics is not None:
+        converter.diagnostics = diagnostics.copy()
+    converter.set_file(input_file, output)
+    converter.start_laps()
+    file_data = bww2abc.read_bww(converter.original_file)
+    converter.lap("read")
+    text = converter.stripNonPrintableCharacters(file_data)
+    converter.lap("strip")
+    tunes = split_tunes(text, converter)
+    converter.lap("find_tunes")
+    if len(tunes) < 2:
+        converter.parse_text(text)
+        return converter.create_output_file()
+
+    #a whole-file conversion warns at every title after the first. the
+    #tunes put together in one piece warn in the worker, the rest here
+    for tune in tunes[1:]:
+        converter.warn("multiple_tunes")
+    name = converter.input_file_name
+    parts = [converter.get_abc_header()]
+    position = 0
+    for (abc, events, elements, tune_stats) in map_tunes(
+            [(piece, name, offset, stats is not None) for (piece, offset) in tunes], jobs):
+        converter.diagnostics.replay(events, position, name)
+        position += elements
+        if tune_stats is not None:
+            stats.merge(tune_stats)
+        parts.append(abc)
+    converter.diagnostics.finish(name)
+    converter.lap("tunes")
+    output_file = converter.write_output_file("".join(parts))
+    converter.lap("write")
+    return output_file
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+#bww2abc_watch: keeps the abc files of a directory tree up to date while
+#the bww files in it are edited.
+#copyright: 2018
+#GPL v3
+#
+#Each scan stats the bww files and compares them to an index of their
+#mtime, size and hash. A file is only read, to hash it, when its mtime or
+#size changed, and only converted when its hash changed too. A file that
+#fails to convert stays in the index as failed, with its hash, and is tried
+#again once it is touched or edited, not on every scan. Outputs of deleted
+#bww files are removed.
+
+import os, time, hashlib
+import bww2abc
+
+class WatchIndex(object):
+    def __init__(self, directory, out_dir=None):
+            self.directory = directory
+            self.out_dir = out_dir
+            #input file -> (mtime, size, hash or None, output file, failed)
+            self.files = {}
+            #the entries of the files scan() returned to convert, until
+            #converted() says how they went
+            self.pending = {}
+
+    def scan(self):
+            #returns the (input file, output) pairs to convert and the
+            #outputs of inputs that are gone
+            found = bww2abc.find_input_files([self.directory], self.out_dir)
+            changed = []
+            seen = set()
+            for (input_file, output) in found:
+                seen.add(input_file)
+                try:
+                    stat = os.stat(input_file)
+                except OSError:
+                    continue
+                entry = self.files.get(input_file)
+                if entry is None:
+                    output_file = output or os.path.splitext(input_file)[0] + ".abc"
+                    if self.up_to_date(stat, output_file):
+                        self.files[input_file] = (stat.st_mtime_ns, stat.st_size, None,
+                            output_file, False)
+                    else:
+                        changed.append((input_file, output, output_file, stat, None, False))
+                    continue
+                (mtime, size, digest, output_file, failed) = entry
+                if mtime == stat.st_mtime_ns and size == stat.st_size:
+                    continue
+                changed.append((input_file, output, output_file, stat, digest, failed))
+
+            pending = []
+            for (input_file, output, output_file, stat, old_digest, failed) in changed:
+                try:
+                    digest = file_hash(input_file)
+                except OSError:
+                    continue
+                entry = (stat.st_mtime_ns, stat.st_size, digest, output_file, False)
+                #a failed file that was touched is tried again too
+                if digest != old_digest or failed:
+                    self.pending[input_file] = entry
+                    pending.append((input_file, output))
+                else:
+                    self.files[input_file] = entry
+
+            #the outputs of deleted files, whether they converted, failed or
+            #are still waiting for converted()
+            removed = []
+            for entries in (self.files, self.pending):
+                for input_file in [name for name in entries if name not in seen]:
+                    output_file = entries.pop(input_file)[3]
+                    if output_file not in removed:
+                        removed.append(output_file)
+            return (pending, removed)
+
+    def converted(self, input_file, ok):
+            #record how the conversion of a file scan() returned went. one
+            #that failed isn't tried again until its mtime or size changes
+            entry = self.pending.pop(input_file, None)
+            if entry is not None:
+                self.files[input_file] = entry[:4] + (not ok,)
+
+    def up_to_date(self, stat, output_file):
+            #like make: an output newer than its input doesn't need doing
+            try:
+                return os.stat(output_file).st_mtime_ns >= stat.st_mtime_ns
+            except OSError:
+                return False
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    file_handle = open(path, "rb")
+    try:
+        for chunk in iter(lambda: file_handle.read(65536), b""):
+            digest.update(chunk)
+    finally:
+        file_handle.close()
+    return digest.hexdigest()
+
+def watch(directory, out_dir=None, interval=1.0, jobs=None, stream=False, cache=None,
+        diagnostics=None, only_changed=False):
+    #convert the changed bww files in directory every interval seconds,
+    #until interrupted. with only_changed an output with the same abc isn't
+    #rewritten
+    index = WatchIndex(directory, out_dir)
+    while True:
+        (pending, removed) = index.scan()
+        if pending:
+            results = bww2abc.convert_found_files(pending, jobs, stream, cache,
+                diagnostics=diagnostics, only_changed=only_changed)
+            for (input_file, output_file, error) in results:
+                index.converted(input_file, not error)
+                if error:
+                    bww2abc.do_print("failed: " + input_file + ": " + error)
+                else:
+                    bww2abc.do_print("converted: " + input_file)
+            if cache is not None:
+                cache.trim()
+        for output_file in removed:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+                bww2abc.do_print("removed: " + output_file)
+        time.sleep(interval)